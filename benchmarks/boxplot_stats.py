@@ -0,0 +1,63 @@
+# Benchmark boxplot statistics computed group by group with boxplot_vals against the vectorized boxplot_stats
+# The data is in the longform format boxplots get from pp (one value per group and draw), or raw data with --draws as rows per group
+# Also times drawing the whole plot to a Vega-Lite spec, and checks that both give the same statistics
+#
+#   python benchmarks/boxplot_stats.py
+#   python benchmarks/boxplot_stats.py --groups 500 --draws 4000 --repeat 3
+
+import argparse, json, sys, time
+import numpy as np
+import pandas as pd
+
+# Longform data with groups spread over two factors, like boxplots with an outer and an inner facet
+def make_data(n_groups, n_draws, seed=0):
+    rng = np.random.default_rng(seed)
+    n_f1 = 5 if n_groups%5==0 else 1
+    f0 = [ f'Group {i+1}' for i in range(n_groups//n_f1) ]
+    f1 = [ f'Sub {i+1}' for i in range(n_f1) ]
+    gi = np.repeat(np.arange(n_groups), n_draws)
+    return pd.DataFrame({
+        'f0': pd.Categorical.from_codes(gi//n_f1, f0),
+        'f1': pd.Categorical.from_codes(gi%n_f1, f1),
+        'draw': np.tile(np.arange(n_draws), n_groups),
+        'value': rng.beta(2, 5, len(gi)) + rng.normal(0, 0.01, n_groups)[gi] }), f0, f1
+
+# Time a function over repeat calls and return the result of the last call along with the fastest time
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); res = fn(); times.append(time.perf_counter()-t0)
+    return res, min(times)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--draws', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import polars as pl
+    pl.enable_string_cache()
+    import altair as alt
+    alt.data_transformers.disable_max_rows()
+    from salk_toolkit.plots import boxplot_vals, boxplot_stats, boxplot_manual
+
+    data, f0, f1 = make_data(args.groups, args.draws)
+    f_cols = ['f0', 'f1']
+
+    ref, t_apply = timed(lambda: data.groupby(f_cols, observed=True)['value'].apply(boxplot_vals).reset_index(), args.repeat)
+    res, t_vec = timed(lambda: boxplot_stats(data, f_cols, 'value'), args.repeat)
+
+    norm = lambda df: df[f_cols+['min','q1','median','q3','max','tmin','tmax']].astype({ c: str for c in f_cols }).sort_values(f_cols).reset_index(drop=True)
+    same = np.allclose(norm(ref).drop(columns=f_cols).to_numpy(float), norm(res).drop(columns=f_cols).to_numpy(float), equal_nan=True)
+
+    facets = [ { 'col': 'f0', 'order': f0, 'colors': alt.Undefined }, { 'col': 'f1', 'order': f1, 'colors': alt.Undefined } ]
+    draw = lambda: boxplot_manual(data.copy(), 'value', facets, val_format='.2f', outer_factors=[], summary=False).to_dict(validate=False)
+    _, t_plot = timed(draw, args.repeat)
+
+    print(json.dumps({ 'groups': args.groups, 'draws': args.draws, 'rows': len(data),
+                       'apply_s': round(t_apply, 4), 'vectorized_s': round(t_vec, 4), 'speedup': round(t_apply/max(t_vec, 1e-9), 1),
+                       'plot_s': round(t_plot, 4), 'same': bool(same) }))
+    if not same:
+        print('WARNING: boxplot_stats differs from boxplot_vals', file=sys.stderr)
+        sys.exit(1)
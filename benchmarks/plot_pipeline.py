@@ -0,0 +1,154 @@
+# Benchmark the whole plot pipeline (pp_transform_data, wrangle_data, create_plot and rendering to a spec)
+# for every registered plot, over a grid of synthetic datasets of different sizes and shapes
+# Datasets are generated with salk_toolkit.synthetic. Results are written as json lines (one per dataset and plot)
+# so that runs, e.g. with different polars versions, can be compared
+#
+#   python benchmarks/plot_pipeline.py --out base.jsonl
+#   python benchmarks/plot_pipeline.py --rows 10000 1000000 10000000 --draws 0 100 4000 --out big.jsonl
+#   python benchmarks/plot_pipeline.py --compare base.jsonl new.jsonl
+
+import argparse, copy, itertools as it, json, os, platform, subprocess, sys, tempfile, time
+import numpy as np
+import pandas as pd
+
+likert_cats = ['Strongly disagree', 'Disagree', 'Neutral', 'Agree', 'Strongly agree']
+party_cats = ['Blue', 'Red', 'Green', 'Yellow', 'Other']
+n_regions = 20 # Filter selectivity is applied by keeping a share of the regions
+
+# Data meta of the benchmark dataset, with a battery of n_questions likert questions
+# and an ordered factor 'segment' with the given number of categories
+def make_meta(n_questions, cardinality):
+    return { 'structure': [
+        { 'name': 'demographics', 'columns': [
+            ['gender', { 'categories': ['Male', 'Female'] }],
+            ['age', { 'continuous': True, 'val_range': [16, 90] }],
+            ['region', { 'categories': [ f'Region {i+1}' for i in range(n_regions) ] }],
+            ['segment', { 'categories': [ f'Segment {i+1}' for i in range(cardinality) ], 'ordered': True }] ] },
+        { 'name': 'party', 'columns': [ ['party', { 'categories': party_cats }] ] },
+        { 'name': 'battery', 'scale': { 'categories': likert_cats, 'ordered': True, 'likert': True },
+          'columns': [ f'b{i+1}' for i in range(n_questions) ] },
+        { 'name': 'thermometer', 'scale': { 'continuous': True, 'val_range': [0, 100] }, 'columns': [ f't_{p.lower()}' for p in party_cats[:4] ] },
+    ] }
+
+# Time a function over repeat calls and return the result of the last call along with the fastest time
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        np.random.seed(0) # Some plots subsample the data
+        t0 = time.perf_counter(); res = fn(); times.append(time.perf_counter()-t0)
+    return res, min(times)
+
+# Description of the environment, so results from different setups can be told apart
+def environment():
+    import polars as pl, altair as alt
+    try: commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError: commit = None
+    return { 'python': platform.python_version(), 'polars': pl.__version__, 'pandas': pd.__version__,
+             'altair': alt.__version__, 'numpy': np.__version__, 'commit': commit, 'machine': platform.machine() }
+
+# Benchmark all (matching) plots on a single dataset configuration
+def run_config(fname, config, plots, repeat, width):
+    import salk_toolkit.pp as pp
+    from salk_toolkit.io import read_annotated_data_lazy, extract_column_meta
+
+    ldf, meta = read_annotated_data_lazy(fname)
+    col_meta = extract_column_meta(meta)
+    n_kept = max(1, round(config['selectivity']*n_regions))
+    flt = { 'region': [ f'Region {i+1}' for i in range(n_kept) ] } if n_kept<n_regions else {}
+
+    # Find the first data description each plot can be drawn with
+    candidates = [ { 'res_col': r, 'factor_cols': f, 'filter': flt } for r in ['party', 'battery', 'thermometer', 'age']
+                   for f in [['segment'], ['segment','gender'], [r,'segment'], []] if f.count(r)<2 and (r not in f or f[0]==r) ]
+    descs = {}
+    for desc in candidates:
+        try: matches = pp.matching_plots(desc, ldf, meta, list_hidden=True)
+        except Exception: continue
+        for p in matches: descs.setdefault(p, desc)
+
+    # Time wrangle_data separately by wrapping it for the duration of the run
+    wrangle_data, wrangle_times = pp.wrangle_data, []
+    def timed_wrangle(*args, **kwargs):
+        t0 = time.perf_counter(); res = wrangle_data(*args, **kwargs); wrangle_times.append(time.perf_counter()-t0)
+        return res
+    pp.wrangle_data = timed_wrangle
+
+    results = []
+    try:
+        for plot in plots or pp.get_all_plots():
+            res = { **config, 'plot': plot }
+            if plot not in descs: results.append({ **res, 'status': 'no_match' }); continue
+            pp_desc = { **descs[plot], 'plot': plot }
+            pp_desc['factor_cols'] = pp.impute_factor_cols(pp_desc, col_meta, pp.get_plot_meta(plot))
+            res.update({ 'res_col': pp_desc['res_col'], 'factor_cols': pp_desc['factor_cols'] })
+            try:
+                wrangle_times.clear()
+                pparams, t_transform = timed(lambda: pp.pp_transform_data(ldf, meta, pp_desc), repeat)
+                plot_obj, t_plot = timed(lambda: pp.create_plot(copy.deepcopy(pparams), meta, pp_desc, width=width), repeat)
+                to_specs = lambda: [ [ p.to_dict() for p in row ] for row in plot_obj ] if isinstance(plot_obj, (list, pp.PlotMatrix)) else plot_obj.to_dict()
+                specs, t_render = timed(to_specs, repeat)
+                res.update({ 'status': 'ok', 'transform_s': round(t_transform, 4), 'wrangle_s': round(min(wrangle_times), 4),
+                             'plot_s': round(t_plot, 4), 'render_s': round(t_render, 4),
+                             'total_s': round(t_transform+t_plot+t_render, 4),
+                             'result_rows': len(pparams['data']), 'spec_bytes': len(json.dumps(specs, default=str)) })
+            except Exception as e:
+                res.update({ 'status': 'error', 'error': repr(e)[:200] })
+            results.append(res)
+    finally: pp.wrangle_data = wrangle_data
+    return results
+
+# Print a per-plot comparison of two result files
+def compare(base_file, new_file):
+    key = lambda r: tuple(str(r.get(k)) for k in ['rows', 'draws', 'questions', 'cardinality', 'selectivity', 'plot'])
+    load = lambda fn: { key(r): r for r in map(json.loads, open(fn)) if r.get('status')=='ok' }
+    base, new = load(base_file), load(new_file)
+    ratios = []
+    for k in sorted(set(base) & set(new)):
+        ratio = new[k]['total_s']/max(base[k]['total_s'], 1e-9)
+        ratios.append(ratio)
+        print(json.dumps({ **dict(zip(['rows', 'draws', 'questions', 'cardinality', 'selectivity', 'plot'], k)),
+                           'base_s': base[k]['total_s'], 'new_s': new[k]['total_s'], 'ratio': round(ratio, 3) }))
+    if ratios: print(json.dumps({ 'compared': len(ratios), 'geomean_ratio': round(float(np.exp(np.mean(np.log(ratios)))), 3) }))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--draws', type=int, nargs='+', default=[0, 100])
+    parser.add_argument('--questions', type=int, nargs='+', default=[10])
+    parser.add_argument('--cardinality', type=int, nargs='+', default=[5, 50])
+    parser.add_argument('--selectivity', type=float, nargs='+', default=[1.0, 0.25])
+    parser.add_argument('--plots', nargs='*', help='Plots to benchmark (default: all registered plots)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='File to write the json lines to (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    import polars as pl
+    pl.enable_string_cache()
+    import altair as alt
+    alt.data_transformers.disable_max_rows()
+    import salk_toolkit.plots
+    from salk_toolkit.synthetic import save_synthetic_parquet
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    env = environment()
+    print(json.dumps({ 'environment': env }), file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows, draws, questions, cardinality in it.product(args.rows, args.draws, args.questions, args.cardinality):
+            meta = make_meta(questions, cardinality)
+            fname = os.path.join(tmpdir, f'bench_{rows}_{draws}_{questions}_{cardinality}.parquet')
+            save_synthetic_parquet(fname, meta, rows, draws=draws, seed=args.seed)
+            for selectivity in args.selectivity:
+                config = { 'rows': rows, 'draws': draws, 'questions': questions, 'cardinality': cardinality, 'selectivity': selectivity }
+                for res in run_config(fname, config, args.plots, args.repeat, args.width):
+                    print(json.dumps({ **res, **env }), file=out, flush=True)
+            os.remove(fname)
+
+    if args.out: out.close()
@@ -0,0 +1,88 @@
+# Benchmark building Vega-Lite specs for every registered plot: validated create_plot(...).to_dict(), create_plot_spec with
+# an empty spec memo cache (fast) and create_plot_spec drawing the same plot again (cached)
+# Also checks that all three give exactly the same spec
+#
+#   python benchmarks/plot_specs.py --rows 20000 --draws 20
+#   python benchmarks/plot_specs.py --plots boxplots columns --repeat 5
+
+import argparse, copy, json, os, re, sys, tempfile
+
+from plot_pipeline import make_meta, timed
+
+# Write a synthetic dataset with categorical, likert and continuous questions (see make_meta in plot_pipeline.py) to a parquet file
+def make_data(fname, n, draws=0, seed=0):
+    from salk_toolkit.synthetic import save_synthetic_parquet
+    save_synthetic_parquet(fname, make_meta(5, 6), n, draws=draws, seed=seed)
+
+# Convert plots (including lists and PlotMatrix of them) to json so results can be compared
+# Names altair generates from a global counter (param_1, view_1, ...) differ between any two builds so they are renumbered
+def to_json(plot):
+    from salk_toolkit.pp import PlotMatrix
+    to_dict = lambda p: p if isinstance(p,dict) else p.to_dict()
+    res = json.dumps([[ to_dict(p) for p in row ] for row in plot ] if isinstance(plot, (list, PlotMatrix)) else to_dict(plot), sort_keys=True, default=str)
+    names = {}
+    return re.sub(r'\b(param|view)_\d+\b', lambda m: names.setdefault(m.group(0), f'{m.group(1)}_{len(names)}'), res)
+
+def run(fname, plots, repeat, width):
+    import polars as pl
+    pl.enable_string_cache()
+    import altair as alt
+    alt.data_transformers.disable_max_rows()
+    import salk_toolkit.plots
+    from salk_toolkit.io import read_annotated_data_lazy, extract_column_meta
+    from salk_toolkit.pp import get_all_plots, get_plot_meta, matching_plots, impute_factor_cols, pp_transform_data, \
+                                create_plot, create_plot_spec, spec_cache
+
+    ldf, meta = read_annotated_data_lazy(fname)
+    col_meta = extract_column_meta(meta)
+    candidates = [ { 'res_col': r, 'factor_cols': f } for r in ['party', 'battery', 'thermometer', 'age']
+                   for f in [[], ['gender'], ['gender','segment'], ['party'], [r,'gender']] if f.count(r)<2 and (r not in f or f[0]==r) ]
+
+    results = []
+    for plot in plots or get_all_plots():
+        for desc in candidates: # Find the first data description the plot can be drawn with
+            try:
+                if plot not in matching_plots(desc, ldf, meta, list_hidden=True): continue
+                pp_desc = { **desc, 'plot': plot }
+                pp_desc['factor_cols'] = impute_factor_cols(pp_desc, col_meta, get_plot_meta(plot))
+                pparams = pp_transform_data(ldf, meta, pp_desc)
+                create_plot(copy.deepcopy(pparams), meta, pp_desc, width=width) # Check it works at all
+                break
+            except Exception: continue
+        else:
+            results.append({ 'plot': plot, 'skipped': True }); print(json.dumps(results[-1])); continue
+
+        validated, t_val = timed(lambda: to_json(create_plot(copy.deepcopy(pparams), meta, pp_desc, width=width)), repeat)
+        def fast():
+            spec_cache.clear()
+            return to_json(create_plot_spec(copy.deepcopy(pparams), meta, pp_desc, width=width))
+        fast_res, t_fast = timed(fast, repeat)
+        cached_res, t_cached = timed(lambda: to_json(create_plot_spec(copy.deepcopy(pparams), meta, pp_desc, width=width)), repeat)
+
+        results.append({ 'plot': plot, 'res_col': desc['res_col'], 'factor_cols': desc['factor_cols'],
+                         'validated_s': round(t_val, 4), 'fast_s': round(t_fast, 4), 'cached_s': round(t_cached, 4),
+                         'speedup': round(t_val/t_fast, 2), 'identical': validated == fast_res == cached_res, 'spec_bytes': len(validated) })
+        print(json.dumps(results[-1]))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--draws', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--plots', nargs='*', help='Plots to benchmark (default: all registered plots)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'plots.parquet')
+        make_data(fname, args.rows, args.draws)
+        results = run(fname, args.plots, args.repeat, args.width)
+
+    done = [ r for r in results if not r.get('skipped') ]
+    print(json.dumps({ 'plots': len(done), 'skipped': len(results)-len(done),
+                       'validated_s': round(sum(r['validated_s'] for r in done), 3), 'fast_s': round(sum(r['fast_s'] for r in done), 3),
+                       'cached_s': round(sum(r['cached_s'] for r in done), 3) }))
+    if not all(r['identical'] for r in done):
+        print('WARNING: fast specs differ from validated ones', file=sys.stderr)
+        sys.exit(1)
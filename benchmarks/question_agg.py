@@ -0,0 +1,72 @@
+# Benchmark aggregation of a battery of grouped questions with and without unpivoting it first
+# Each strategy runs in its own process so that peak memory (max RSS) is measured separately
+#
+#   python benchmarks/question_agg.py --rows 1000000 --questions 40
+#   python benchmarks/question_agg.py --rows 200000 --questions 40 --draws 100 --plot boxplots
+
+import argparse, hashlib, json, os, resource, subprocess, sys, tempfile, time
+
+from plot_pipeline import make_meta
+
+# Write a synthetic dataset with a battery of likert questions (see make_meta in plot_pipeline.py) to a parquet file
+def make_data(fname, n, n_questions, draws=0, seed=0):
+    from salk_toolkit.synthetic import save_synthetic_parquet
+    save_synthetic_parquet(fname, make_meta(n_questions, 6), n, draws=draws, seed=seed)
+
+# Run one strategy in the current process and print the result as json
+def run(fname, strategy, plot):
+    import psutil
+    import polars as pl
+    pl.enable_string_cache()
+    import salk_toolkit.plots
+    from salk_toolkit.io import read_annotated_data_lazy
+    from salk_toolkit.pp import pp_transform_data
+
+    ldf, meta = read_annotated_data_lazy(fname)
+    rss0 = psutil.Process().memory_info().rss
+    t0 = time.perf_counter()
+    pparams = pp_transform_data(ldf, meta, { 'res_col': 'battery', 'factor_cols': ['question', 'gender', 'segment'],
+                                             'plot': plot, 'question_strategy': strategy })
+    elapsed = time.perf_counter() - t0
+
+    data = pparams['data']
+    data = data.sort_values(list(data.columns)).reset_index(drop=True).round(10)
+    print(json.dumps({
+        'strategy': strategy,
+        'time_s': round(elapsed, 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1),
+        'peak_increase_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 - rss0/1024**2, 1),
+        'result_rows': len(data),
+        'checksum': hashlib.md5(data.to_csv().encode()).hexdigest(),
+    }))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--questions', type=int, default=40)
+    parser.add_argument('--draws', type=int, default=0)
+    parser.add_argument('--plot', default='stacked_columns')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--run', nargs=2, metavar=('FILE', 'STRATEGY'), help=argparse.SUPPRESS) # Internal: run a single strategy
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run[0], args.run[1], args.plot)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'battery.parquet')
+        make_data(fname, args.rows, args.questions, args.draws)
+
+        results = []
+        for _ in range(args.repeat):
+            for strategy in ['unpivot', 'columns']:
+                out = subprocess.run([sys.executable, __file__, '--plot', args.plot, '--run', fname, strategy],
+                                     capture_output=True, text=True, check=True).stdout
+                res = json.loads(out.strip().split('\n')[-1])
+                results.append({ 'rows': args.rows, 'questions': args.questions, 'draws': args.draws, 'plot': args.plot, **res })
+                print(json.dumps(results[-1]))
+
+    if len({ r['checksum'] for r in results }) > 1:
+        print('WARNING: strategies gave different results', file=sys.stderr)
+        sys.exit(1)
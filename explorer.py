@@ -9,6 +9,7 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 # If true, the profiler will be shown
 profile = False
 memprofile = False
+trace = False # If true, stages of drawing the plots are traced to plot_trace.json (view it in chrome://tracing or Perfetto)
 
 if memprofile:
     import tracemalloc
@@ -43,17 +44,13 @@ with st.spinner("Loading libraries.."):
     from pandas.api.types import is_numeric_dtype
     from streamlit_js import st_js, st_js_blocking
 
-    from salk_toolkit.io import read_json, extract_column_meta, read_annotated_data_lazy
+    from salk_toolkit.io import read_json, extract_column_meta, read_annotated_data_lazy, file_fingerprint, combine_annotated_data
     from salk_toolkit.pp import *
     from salk_toolkit.utils import *
     from salk_toolkit.dashboard import draw_plot_matrix, facet_ui, filter_ui, get_plot_width, default_translate, stss_safety
 
     tqdm = lambda x: x # So we can freely copy-paste from notebooks
 
-    # Disable altair schema validations by setting debug_mode = False
-    # This speeds plots up considerably as altair performs an excessive amount of these validation for some reason
-    dm = alt.utils.schemapi.debug_mode(False); dm.__enter__()
-
 # Override the st_dimensions based version that can cause refresh loops
 #def get_plot_width(str):
 #    return 800
@@ -116,7 +113,7 @@ def load_file(input_file):
     n0 = ldf.select(pl.len()).collect().item()
     n = dmeta.get('total_size', n0) # N0 is count of rows which is a fallback for older versions
     if dmeta is None: dmeta = {}
-    return { 'data': ldf, 'total_size': n, 'data_meta': dmeta, 'model_meta': mmeta, 'columns': columns }
+    return { 'data': ldf, 'total_size': n, 'data_meta': dmeta, 'model_meta': mmeta, 'columns': columns, 'fingerprint': file_fingerprint(ifile) }
 
 if len(input_files)==0:
     st.markdown("""Please choose an input file from the sidebar""")
@@ -210,7 +207,7 @@ with st.sidebar: #.expander("Select dimensions"):
     args['factor_cols'] = impute_factor_cols(args, c_meta)
 
     # Plot type
-    matching = matching_plots(args, first_data, first_data_meta)
+    matching = matching_plots(args, first_data, first_data_meta, fingerprint=first_file['fingerprint'] if global_data_meta is None else None)
     plot_list = ['default'] + sorted(matching)
     if 'plot_type' in st.session_state:
         if st.session_state['plot_type'] not in matching: st.session_state['plot_type']='default'
@@ -242,7 +239,8 @@ with st.sidebar: #.expander("Select dimensions"):
         if res_cont: # Extra settings for continuous data 
             cont_transform = st.selectbox('Transform', ['None'] + cont_transform_options, key='transform')
             if cont_transform != 'None': args['cont_transform'] = cont_transform
-            agg_fn = st.selectbox('Aggregation', ['mean', 'median', 'sum'], key='aggregation')
+            agg_fn = st.selectbox('Aggregation', ['mean', 'median', 'quantile', 'iqr', 'sum'], key='aggregation')
+            if agg_fn=='quantile': agg_fn = f"q{st.slider('Quantile (%)', 1, 99, 25, key='agg_quantile')}"
             if agg_fn!='mean': args['agg_fn'] = agg_fn
 
         sortable = args['factor_cols']
@@ -298,90 +296,85 @@ if not input_files_facet:
     cols = st.columns(len(input_files))
 else: cols = [contextlib.suppress()]
 
-if not draw:
-    st.text("Plot drawing disabled for refresh speed")
-elif input_files_facet:
-    #with st.spinner('Filtering data...'):
+# Stages of drawing are traced for the duration of the with block, also if drawing fails
+with (plot_trace() if trace else contextlib.nullcontext()) as plot_trace_data:
+    if not draw:
+        st.text("Plot drawing disabled for refresh speed")
+    elif input_files_facet:
+        #with st.spinner('Filtering data...'):
     
-    # This is a bit hacky because of previous use of the lazy data frames
-    dfs = []
-    for ifile in input_files:
-        df, fargs = loaded[ifile]['data'], args.copy()
-        fargs['filter'] = { k:v for k,v in fargs['filter'].items() if k in loaded[ifile]['columns'] }
-        fargs['factor_cols'] = [ f for f in fargs['factor_cols'] if f!='input_file' ]
-        pparams = pp_transform_data(df, first_data_meta, fargs)
-        dfs.append(pparams['data'])
-
-    fdf = pd.concat(dfs)
-
-    # Fix categories to match the first file in case there are discrepancies (like only one being ordered)
-    for c in fdf.columns:
-        if fdf[c].dtype.name!='category' and dfs[0][c].dtype.name=='category':
-            fdf[c] = pd.Categorical(fdf[c],dtype=dfs[0][c].dtype)
-
-    fdf['input_file'] = pd.Categorical(
-        [ v for i,f in enumerate(input_files) for v in [f]*len(dfs[i]) ],input_files)
-
-    pparams['data'] = fdf
-    plot = create_plot(pparams,first_data_meta,args,
-                       translate=translate,
-                       width=get_plot_width('full'),
-                       return_matrix_of_plots=matrix_form)
-
-    draw_plot_matrix(plot)
-    #st.altair_chart(plot)#,use_container_width=True)
-
-else:
-    # Iterate over input files
-    for i, ifile in enumerate(input_files):
-        with cols[i]:
-            
-            # Heading:
-            st.header(os.path.splitext(ifile.replace('_',' '))[0])
-
-            data_meta = loaded[ifile]['data_meta'] if global_data_meta is None else global_data_meta
-            if data_meta is None: data_meta = first_data_meta
-
-            if (args['res_col'] in all_cols   # I.e. it is a column, not a group
-                and args['res_col'] not in loaded[ifile]['columns']):
-                st.write(f"'{args['res_col']}' not present")
-                continue
-
-            #with st.spinner('Filtering data...'):
-            fargs = args.copy()
-            fargs['filter'] = { k:v for k,v in args['filter'].items() if k in loaded[ifile]['columns'] }
-            pparams = pp_transform_data(loaded[ifile]['data'], data_meta, fargs)
-            plot = create_plot(pparams,data_meta,fargs,
-                               translate=translate,
-                               width=get_plot_width(f'{i}_{ifile}'),
-                               return_matrix_of_plots=matrix_form)
-
-            #n_questions = pparams['data']['question'].nunique() if 'question' in pparams['data'] else 1
-            #st.write('Based on %.1f%% of data' % (100*pparams['n_datapoints']/(len(loaded[ifile]['data_n'])*n_questions)))
-            st.write('Based on %.1f%% of data' % (100*pparams['filtered_size']/loaded[ifile]['total_size']))
-            #st.altair_chart(plot)#, use_container_width=(len(input_files)>1))
-            draw_plot_matrix(plot)
-
-            with st.expander('Data Meta'):
-                st.json(loaded[ifile]['data_meta'])
-
-            mdl = loaded[ifile]['model_meta'].copy()
-
-            if 'sequence' in mdl:
-                steps = { m['name']: m for m in mdl['sequence'] }
-                del mdl['sequence']
-            else: steps = {}
-            steps['main_model'] = mdl
-            with st.expander('Model'):
-                step_name = st.selectbox('Show:', list(steps.keys()), len(steps)-1,key='mdlshow_'+ifile)
-                st.json(steps[step_name])
+        # Files are combined into one dataset with an input_file column, so all of them are aggregated in a single query
+        # Filters on columns missing from a file are skipped for that file
+        combined_data, combined_meta = combine_annotated_data([ loaded[ifile]['data'] for ifile in input_files ],
+            [ (loaded[ifile]['data_meta'] if global_data_meta is None else global_data_meta) or first_data_meta for ifile in input_files ], input_files)
+        pparams = pp_transform_data(combined_data, combined_meta, args)
+
+        # Plots are drawn as specs (see create_plot_spec), which are serialized without validation and cached so redrawing is nearly free
+        plot = create_plot_spec(pparams,combined_meta,args,
+                           translate=translate,
+                           width=get_plot_width('full'),
+                           return_matrix_of_plots=matrix_form)
+
+        draw_plot_matrix(plot, page_rows=10)
+        #st.altair_chart(plot)#,use_container_width=True)
+
+    else:
+        # Files that have the result column (i.e. it is a group or a column present in them)
+        present = [ ifile for ifile in input_files if args['res_col'] not in all_cols or args['res_col'] in loaded[ifile]['columns'] ]
+        data_metas = [ loaded[ifile]['data_meta'] if global_data_meta is None else global_data_meta for ifile in present ]
+        data_metas = [ dm if dm is not None else first_data_meta for dm in data_metas ]
+
+        # Headings, and plot widths as these are measured from the column they are in
+        widths = {}
+        for i, ifile in enumerate(input_files):
+            with cols[i]:
+                st.header(os.path.splitext(ifile.replace('_',' '))[0])
+                if ifile in present: widths[ifile] = get_plot_width(f'{i}_{ifile}')
+
+        # Process all files concurrently before drawing them one by one
+        #with st.spinner('Filtering data...'):
+        pparams_list = pp_transform_data_many([ loaded[ifile]['data'] for ifile in present ], data_metas, args,
+                                              columns=[ loaded[ifile]['columns'] for ifile in present ])
+        plots = create_plot_many(pparams_list, data_metas, [ prune_filter(args, loaded[ifile]['columns']) for ifile in present ],
+                                 as_spec=True, translate=translate, return_matrix_of_plots=matrix_form,
+                                 width=[ widths[ifile] for ifile in present ])
+        results = dict(zip(present, zip(pparams_list, plots)))
+
+        # Iterate over input files
+        for i, ifile in enumerate(input_files):
+            with cols[i]:
+                if ifile not in results:
+                    st.write(f"'{args['res_col']}' not present")
+                    continue
+
+                pparams, plot = results[ifile]
+
+                #n_questions = pparams['data']['question'].nunique() if 'question' in pparams['data'] else 1
+                #st.write('Based on %.1f%% of data' % (100*pparams['n_datapoints']/(len(loaded[ifile]['data_n'])*n_questions)))
+                st.write('Based on %.1f%% of data' % (100*pparams['filtered_size']/loaded[ifile]['total_size']))
+                #st.altair_chart(plot)#, use_container_width=(len(input_files)>1))
+                draw_plot_matrix(plot, page_rows=10, key=f'plot_matrix_{i}')
+
+                with st.expander('Data Meta'):
+                    st.json(loaded[ifile]['data_meta'])
+
+                mdl = loaded[ifile]['model_meta'].copy()
+
+                if 'sequence' in mdl:
+                    steps = { m['name']: m for m in mdl['sequence'] }
+                    del mdl['sequence']
+                else: steps = {}
+                steps['main_model'] = mdl
+                with st.expander('Model'):
+                    step_name = st.selectbox('Show:', list(steps.keys()), len(steps)-1,key='mdlshow_'+ifile)
+                    st.json(steps[step_name])
+
+if trace: trace_to_chrome(plot_trace_data, 'plot_trace.json')
 
 info.empty()
 
 st.sidebar.write("Mem: %.1f" % (psutil.Process(os.getpid()).memory_info().rss / 1024 ** 2))
 
-dm.__exit__(None,None,None)
-
 if memprofile:
     snapshot = tracemalloc.take_snapshot()
     top_stats = snapshot.statistics('filename')
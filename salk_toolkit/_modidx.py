@@ -91,10 +91,14 @@ d = { 'settings': { 'branch': 'main',
                                                                                   'salk_toolkit/dashboard.py'),
                                         'salk_toolkit.dashboard.st_plot': ('dashboard.html#st_plot', 'salk_toolkit/dashboard.py'),
                                         'salk_toolkit.dashboard.stss_safety': ('dashboard.html#stss_safety', 'salk_toolkit/dashboard.py'),
+                                        'salk_toolkit.dashboard.translate_cache_key': ( 'dashboard.html#translate_cache_key',
+                                                                                        'salk_toolkit/dashboard.py'),
                                         'salk_toolkit.dashboard.translate_fn_from_po': ( 'dashboard.html#translate_fn_from_po',
                                                                                          'salk_toolkit/dashboard.py'),
                                         'salk_toolkit.dashboard.translate_with_dict': ( 'dashboard.html#translate_with_dict',
                                                                                         'salk_toolkit/dashboard.py'),
+                                        'salk_toolkit.dashboard.translation_file': ( 'dashboard.html#translation_file',
+                                                                                     'salk_toolkit/dashboard.py'),
                                         'salk_toolkit.dashboard.user_settings_page': ( 'dashboard.html#user_settings_page',
                                                                                        'salk_toolkit/dashboard.py'),
                                         'salk_toolkit.dashboard.wrap_st_with_translate': ( 'dashboard.html#wrap_st_with_translate',
@@ -115,12 +119,15 @@ d = { 'settings': { 'branch': 'main',
                                                                                                      'salk_toolkit/election_models.py'),
                                               'salk_toolkit.election_models.vec_smallest_k': ( 'election_models.html#vec_smallest_k',
                                                                                                'salk_toolkit/election_models.py')},
-            'salk_toolkit.io': { 'salk_toolkit.io.change_mapping': ('io.html#change_mapping', 'salk_toolkit/io.py'),
+            'salk_toolkit.io': { 'salk_toolkit.io.add_quantile_sketches': ('io.html#add_quantile_sketches', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.change_mapping': ('io.html#change_mapping', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.change_meta_df': ('io.html#change_meta_df', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.combine_annotated_data': ('io.html#combine_annotated_data', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.convert_number_series_to_categorical': ( 'io.html#convert_number_series_to_categorical',
                                                                                            'salk_toolkit/io.py'),
                                  'salk_toolkit.io.data_with_inferred_meta': ('io.html#data_with_inferred_meta', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.extract_column_meta': ('io.html#extract_column_meta', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.file_fingerprint': ('io.html#file_fingerprint', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.find_type_in_dict': ('io.html#find_type_in_dict', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.fix_df_with_meta': ('io.html#fix_df_with_meta', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.fix_meta_categories': ('io.html#fix_meta_categories', 'salk_toolkit/io.py'),
@@ -135,11 +142,14 @@ d = { 'settings': { 'branch': 'main',
                                  'salk_toolkit.io.load_parquet_metadata': ('io.html#load_parquet_metadata', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.load_parquet_with_metadata': ('io.html#load_parquet_with_metadata', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.load_population_h5': ('io.html#load_population_h5', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.parquet_to_arrow_ipc': ('io.html#parquet_to_arrow_ipc', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.perform_merges': ('io.html#perform_merges', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.process_annotated_data': ('io.html#process_annotated_data', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.quantile_sketches': ('io.html#quantile_sketches', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.read_and_process_data': ('io.html#read_and_process_data', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.read_annotated_data': ('io.html#read_annotated_data', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.read_annotated_data_lazy': ('io.html#read_annotated_data_lazy', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.read_annotated_data_multi': ('io.html#read_annotated_data_multi', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.read_concatenate_files_list': ( 'io.html#read_concatenate_files_list',
                                                                                   'salk_toolkit/io.py'),
                                  'salk_toolkit.io.read_json': ('io.html#read_json', 'salk_toolkit/io.py'),
@@ -150,11 +160,18 @@ d = { 'settings': { 'branch': 'main',
                                  'salk_toolkit.io.save_population_h5': ('io.html#save_population_h5', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.save_sample_h5': ('io.html#save_sample_h5', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.set_file_map': ('io.html#set_file_map', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.shared_store_cleanup': ('io.html#shared_store_cleanup', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.shared_store_lock': ('io.html#shared_store_lock', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.shared_store_open': ('io.html#shared_store_open', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.shared_store_path': ('io.html#shared_store_path', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.shared_store_release': ('io.html#shared_store_release', 'salk_toolkit/io.py'),
+                                 'salk_toolkit.io.shared_store_users': ('io.html#shared_store_users', 'salk_toolkit/io.py'),
                                  'salk_toolkit.io.str_from_list': ('io.html#str_from_list', 'salk_toolkit/io.py')},
             'salk_toolkit.plots': { 'salk_toolkit.plots.area_smooth': ('plots.html#area_smooth', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.barbell': ('plots.html#barbell', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.beta_binomial_fit': ('plots.html#beta_binomial_fit', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.boxplot_manual': ('plots.html#boxplot_manual', 'salk_toolkit/plots.py'),
+                                    'salk_toolkit.plots.boxplot_stats': ('plots.html#boxplot_stats', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.boxplot_vals': ('plots.html#boxplot_vals', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.cluster_based_reorder': ( 'plots.html#cluster_based_reorder',
                                                                                   'salk_toolkit/plots.py'),
@@ -192,32 +209,121 @@ d = { 'settings': { 'branch': 'main',
                                     'salk_toolkit.plots.stacked_columns': ('plots.html#stacked_columns', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.vectorized_mn': ('plots.html#vectorized_mn', 'salk_toolkit/plots.py'),
                                     'salk_toolkit.plots.violin': ('plots.html#violin', 'salk_toolkit/plots.py')},
-            'salk_toolkit.pp': { 'salk_toolkit.pp.augment_draws': ('pp.html#augment_draws', 'salk_toolkit/pp.py'),
+            'salk_toolkit.pp': { 'salk_toolkit.pp.PlotMatrix': ('pp.html#plotmatrix', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrix.__getitem__': ('pp.html#plotmatrix.__getitem__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrix.__init__': ('pp.html#plotmatrix.__init__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrix.__iter__': ('pp.html#plotmatrix.__iter__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrix.__len__': ('pp.html#plotmatrix.__len__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrix.plot': ('pp.html#plotmatrix.plot', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrix.to_list': ('pp.html#plotmatrix.to_list', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrixRow': ('pp.html#plotmatrixrow', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrixRow.__getitem__': ('pp.html#plotmatrixrow.__getitem__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrixRow.__init__': ('pp.html#plotmatrixrow.__init__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrixRow.__iter__': ('pp.html#plotmatrixrow.__iter__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.PlotMatrixRow.__len__': ('pp.html#plotmatrixrow.__len__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.TranslationTable': ('pp.html#translationtable', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.TranslationTable.__call__': ('pp.html#translationtable.__call__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.TranslationTable.__init__': ('pp.html#translationtable.__init__', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.TranslationTable.__missing__': ( 'pp.html#translationtable.__missing__',
+                                                                                   'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.TranslationTable.add_meta': ('pp.html#translationtable.add_meta', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.aggregate_longform': ('pp.html#aggregate_longform', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.async_create_plot_spec': ('pp.html#async_create_plot_spec', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.async_e2e_plot': ('pp.html#async_e2e_plot', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.async_pp_transform_data': ('pp.html#async_pp_transform_data', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.async_semaphore': ('pp.html#async_semaphore', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.augment_draws': ('pp.html#augment_draws', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.calculate_priority': ('pp.html#calculate_priority', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.capability_index': ('pp.html#capability_index', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.codes_in': ('pp.html#codes_in', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.column_categories': ('pp.html#column_categories', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.columns_min': ('pp.html#columns_min', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.compile_filter': ('pp.html#compile_filter', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.create_plot': ('pp.html#create_plot', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.create_plot_many': ('pp.html#create_plot_many', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.create_plot_spec': ('pp.html#create_plot_spec', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.create_tooltip': ('pp.html#create_tooltip', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.decode_categoricals': ('pp.html#decode_categoricals', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.decode_categoricals_pl': ('pp.html#decode_categoricals_pl', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.discretize_continuous': ('pp.html#discretize_continuous', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.e2e_plot': ('pp.html#e2e_plot', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.e2e_prepare': ('pp.html#e2e_prepare', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.encode_categoricals': ('pp.html#encode_categoricals', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.ensure_ldf_categories': ('pp.html#ensure_ldf_categories', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.estimate_plot_size': ('pp.html#estimate_plot_size', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.fix_categories_pl': ('pp.html#fix_categories_pl', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.get_all_plots': ('pp.html#get_all_plots', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.get_cat_num_vals': ('pp.html#get_cat_num_vals', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.get_cats': ('pp.html#get_cats', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.get_plot_fn': ('pp.html#get_plot_fn', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.get_plot_meta': ('pp.html#get_plot_meta', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.get_registry_buckets': ('pp.html#get_registry_buckets', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.get_translation_table': ('pp.html#get_translation_table', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.impute_factor_cols': ('pp.html#impute_factor_cols', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.inner_outer_factors': ('pp.html#inner_outer_factors', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.matching_plots': ('pp.html#matching_plots', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.memory_guard': ('pp.html#memory_guard', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.meta_color_scale': ('pp.html#meta_color_scale', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.plot_data_to_pandas': ('pp.html#plot_data_to_pandas', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.plot_to_spec': ('pp.html#plot_to_spec', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.plot_trace': ('pp.html#plot_trace', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.pp_filter_data': ('pp.html#pp_filter_data', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.pp_filter_data_lz': ('pp.html#pp_filter_data_lz', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.pp_transform_data': ('pp.html#pp_transform_data', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.pp_transform_data_many': ('pp.html#pp_transform_data_many', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.pp_transform_data_progressive': ( 'pp.html#pp_transform_data_progressive',
+                                                                                    'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.prune_filter': ('pp.html#prune_filter', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.remove_from_internal_fcols': ('pp.html#remove_from_internal_fcols', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.rename_columns': ('pp.html#rename_columns', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.replace_plot_data': ('pp.html#replace_plot_data', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.reset_plot_matching': ('pp.html#reset_plot_matching', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.run_in_executor': ('pp.html#run_in_executor', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.sampling_error': ('pp.html#sampling_error', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.spec_cache_key': ('pp.html#spec_cache_key', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.stk_deregister': ('pp.html#stk_deregister', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.stk_plot': ('pp.html#stk_plot', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.stratified_sample': ('pp.html#stratified_sample', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.summarize_draws': ('pp.html#summarize_draws', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.test_new_plot': ('pp.html#test_new_plot', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.trace_collect': ('pp.html#trace_collect', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.trace_end': ('pp.html#trace_end', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.trace_rss_mb': ('pp.html#trace_rss_mb', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.trace_span': ('pp.html#trace_span', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.trace_start': ('pp.html#trace_start', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.trace_to_chrome': ('pp.html#trace_to_chrome', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.traced': ('pp.html#traced', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.transform_cont': ('pp.html#transform_cont', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.translate_df': ('pp.html#translate_df', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.vl_csv_data': ('pp.html#vl_csv_data', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.weighted_quantile': ('pp.html#weighted_quantile', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.weighted_quantile_agg': ('pp.html#weighted_quantile_agg', 'salk_toolkit/pp.py'),
+                                 'salk_toolkit.pp.with_string_cache': ('pp.html#with_string_cache', 'salk_toolkit/pp.py'),
                                  'salk_toolkit.pp.wrangle_data': ('pp.html#wrangle_data', 'salk_toolkit/pp.py')},
+            'salk_toolkit.server': { 'salk_toolkit.server.PlotServer': ('server.html#plotserver', 'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.PlotServer.__init__': ( 'server.html#plotserver.__init__',
+                                                                                  'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.PlotServer.get_dataset': ( 'server.html#plotserver.get_dataset',
+                                                                                     'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.PlotServer.http_server': ( 'server.html#plotserver.http_server',
+                                                                                     'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.PlotServer.plot': ('server.html#plotserver.plot', 'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.RequestError': ('server.html#requesterror', 'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.RequestError.__init__': ( 'server.html#requesterror.__init__',
+                                                                                    'salk_toolkit/server.py'),
+                                     'salk_toolkit.server.main': ('server.html#main', 'salk_toolkit/server.py')},
+            'salk_toolkit.synthetic': { 'salk_toolkit.synthetic.latent_to_values': ( 'synthetic.html#latent_to_values',
+                                                                                     'salk_toolkit/synthetic.py'),
+                                        'salk_toolkit.synthetic.save_synthetic_parquet': ( 'synthetic.html#save_synthetic_parquet',
+                                                                                           'salk_toolkit/synthetic.py'),
+                                        'salk_toolkit.synthetic.synthetic_chunks': ( 'synthetic.html#synthetic_chunks',
+                                                                                     'salk_toolkit/synthetic.py'),
+                                        'salk_toolkit.synthetic.synthetic_columns': ( 'synthetic.html#synthetic_columns',
+                                                                                      'salk_toolkit/synthetic.py'),
+                                        'salk_toolkit.synthetic.synthetic_data': ( 'synthetic.html#synthetic_data',
+                                                                                   'salk_toolkit/synthetic.py'),
+                                        'salk_toolkit.synthetic.synthetic_meta': ( 'synthetic.html#synthetic_meta',
+                                                                                   'salk_toolkit/synthetic.py')},
             'salk_toolkit.utils': { 'salk_toolkit.utils.aggregate_multiselect': ( 'utils.html#aggregate_multiselect',
                                                                                   'salk_toolkit/utils.py'),
                                     'salk_toolkit.utils.approx_str_match': ('utils.html#approx_str_match', 'salk_toolkit/utils.py'),
@@ -28,7 +28,7 @@ from pandas.api.types import is_numeric_dtype
 
 from salk_toolkit.utils import *
 from salk_toolkit.io import *
-from salk_toolkit.pp import e2e_plot
+from salk_toolkit.pp import e2e_plot, PlotMatrix, get_translation_table
 
 import streamlit as st
 from streamlit_option_menu import option_menu
@@ -139,33 +139,49 @@ def translate_fn_from_po(po_file):
     td = { entry.msgid: entry.msgstr for entry in po }
     return lambda s, **kwargs: td.get(s,s)
 
+# Translation file for translate given as a string, which is either a file name or a country code
+def translation_file(translate):
+    if os.path.exists(translate): return translate
+    elif len(translate)==2: # country code
+        bname = os.path.splitext(os.path.basename(__main__.__file__))[0]
+        return f'locale/{translate}/{bname}.po'
+    else:
+        raise ValueError(f"Translation file not found: {translate}")
+
 def load_translate(translate):
 
     if translate is None: return default_translate
     elif callable(translate): return translate
     elif isinstance(translate,dict): return lambda s, **kwargs: translate.get(s,s)
     elif isinstance(translate,str):
-        if os.path.exists(translate):
-            ext = os.path.splitext(translate)[1]
-            if ext == '.po' or ext == '.pot':
-                return translate_fn_from_po(translate)
-            elif ext == '.json':
-                td = load_json_cached(translate)
-                return lambda s, **kwargs: td.get(s,s)
-            else:
-                raise ValueError(f"Unknown translation file type: {ext}")
-        elif len(translate)==2: # country code
-            bname = os.path.splitext(os.path.basename(__main__.__file__))[0]
-            return translate_fn_from_po(f'locale/{translate}/{bname}.po')
+        fname = translation_file(translate)
+        ext = os.path.splitext(fname)[1]
+        if ext == '.po' or ext == '.pot':
+            return translate_fn_from_po(fname)
+        elif ext == '.json':
+            td = load_json_cached(fname)
+            return lambda s, **kwargs: td.get(s,s)
         else:
-            raise ValueError(f"Translation file not found: {translate}")
+            raise ValueError(f"Unknown translation file type: {ext}")
+
+# Key for caching translations made with translate (see get_translation_table), or None if they should not be cached
+# Files are keyed by path and modification time, so the cache is not used after the file changes
+# Functions are their own key, which keeps them alive in the cache so their id can not be reused by another function
+def translate_cache_key(translate):
+    if translate is None: return 'default'
+    elif callable(translate): return translate
+    elif isinstance(translate,str):
+        fname = translation_file(translate)
+        return (os.path.abspath(fname), os.stat(fname).st_mtime_ns)
+    else: return None
 
 
 # %% ../nbs/05_dashboard.ipynb 11
 # Main dashboard wrapper - WIP
 class SalkDashboardBuilder:
 
-    def __init__(self, data_source, auth_conf, logfile, groups=['guest','user','admin'], org_whitelist=None, public=False, translate=None):
+    # With shared_data=True, data is read through the shared store so worker processes on the same host share one copy of it
+    def __init__(self, data_source, auth_conf, logfile, groups=['guest','user','admin'], org_whitelist=None, public=False, translate=None, shared_data=False):
         
         # Allow deployment.json to redirect files from local to s3 if local missing (i.e. in deployment scenario)
         if os.path.exists('./deployment.json'):
@@ -178,6 +194,7 @@ class SalkDashboardBuilder:
         self.log_path = alias_file(logfile, self.filemap)
         self.s3fs = s3fs.S3FileSystem(anon=False) # Initialize s3 access. Key in secrets.toml
         self.data_source = data_source
+        self.shared_data = shared_data
         self.public = public
         self.pages = []
         self.sb_info = st.sidebar.empty()
@@ -188,6 +205,7 @@ class SalkDashboardBuilder:
         
         # Set up translation
         pot_updater = po_template_updater()
+        self.translate_key = translate_cache_key(translate)
         translate = load_translate(translate)
         self.tf = lambda s,**kwargs: translate(pot_updater(s,**kwargs))
         
@@ -236,8 +254,12 @@ class SalkDashboardBuilder:
             self.p_widths[pos_id] = width
         
         # Draw plot
+        # Translations of the data are looked up from a table built once per dataset and translation
+        # Without a table like this, create_plot only memoizes translations within a single plot
+        tkey = (self.data_source, self.translate_key) if self.translate_key is not None else None
+        translate = get_translation_table(lambda s: self.tf(s,context='data'), self.meta, key=tkey)
         st_plot(pp_desc,
-                width=width, translate=lambda s: self.tf(s,context='data'),
+                width=width, translate=translate,
                 full_df=self.ldf,data_meta=self.meta,**kwargs)
         
     def filter_ui(self, dims, detailed=False, raw=False, force_choice=False, key=''):
@@ -306,7 +328,7 @@ class SalkDashboardBuilder:
                 print(f'Downloading {self.filemap[self.data_source]} to {self.data_source}')
                 self.s3fs.download(self.filemap[self.data_source],self.data_source)
 
-            self.ldf, self.meta = read_annotated_data_lazy_cached(self.data_source)
+            self.ldf, self.meta = read_annotated_data_lazy_cached(self.data_source, shared=self.shared_data)
             #self.df = self.ldf.collect().to_pandas() # Backwards compatibility
         
         # Render the chosen page
@@ -606,20 +628,33 @@ def admin_page(sdb):
 # See https://github.com/altair-viz/altair/issues/2369 -> https://github.com/vega/vega-lite/issues/3729
 
 # Draw a matrix of plots using separate plots and st columns
-def draw_plot_matrix(pmat):
+# Lazy plot matrices (see PlotMatrix) with more than page_rows rows are paginated, so only the shown plots get created
+# Plots can be either altair plots or Vega-Lite spec dicts (see create_plot_spec)
+def draw_plot_matrix(pmat, page_rows=None, key='plot_matrix'):
     if not pmat: return # Do nothing if get None passed to it
-    if not isinstance(pmat,list): pmat, ucw = [[pmat]], False
+    if not isinstance(pmat,(list,PlotMatrix)): pmat, ucw = [[pmat]], False
     else: ucw = True # If we are drawing more than one plot, we want to use the container width
+    if isinstance(pmat,PlotMatrix) and page_rows and len(pmat)>page_rows:
+        page = st.number_input('Page', min_value=1, max_value=-(-len(pmat)//page_rows), value=1, key=key)
+        pmat = pmat[(page-1)*page_rows:page*page_rows]
     cols = st.columns(len(pmat[0])) if len(pmat[0])>1 else [st]
     for j,c in enumerate(cols):
         for i, row in enumerate(pmat):
             if j>=len(pmat[i]): continue
-            c.altair_chart(pmat[i][j],use_container_width=ucw)
+            if isinstance(pmat[i][j],dict): c.vega_lite_chart(spec=pmat[i][j],use_container_width=ucw)
+            else: c.altair_chart(pmat[i][j],use_container_width=ucw)
 
 # Draw the plot described by pp_desc 
-def st_plot(pp_desc,**kwargs):
-    plots = e2e_plot(pp_desc, **kwargs)
-    draw_plot_matrix(plots)
+# With progressive=True, a quick approximate version is drawn first and then replaced by the full one
+def st_plot(pp_desc, progressive=False, **kwargs):
+    if progressive:
+        ph = st.empty()
+        def draw(plots, _):
+            with ph.container(): draw_plot_matrix(plots)
+        draw(e2e_plot(pp_desc, progressive=draw, **kwargs), None)
+    else:
+        plots = e2e_plot(pp_desc, **kwargs)
+        draw_plot_matrix(plots)
 
 # %% ../nbs/05_dashboard.ipynb 23
 # Streamlit session state safety - check and clear session state if it has an unfit value
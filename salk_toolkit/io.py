@@ -3,16 +3,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/01_io.ipynb.
 
 # %% auto 0
-__all__ = ['stk_loaded_files_set', 'stk_file_map', 'max_cats', 'custom_meta_key', 'read_json', 'get_loaded_files',
-           'reset_file_tracking', 'get_file_map', 'set_file_map', 'process_annotated_data', 'read_annotated_data',
-           'read_annotated_data_lazy', 'fix_df_with_meta', 'extract_column_meta', 'group_columns_dict', 'list_aliases',
-           'change_meta_df', 'replace_data_meta_in_parquet', 'fix_meta_categories', 'fix_parquet_categories',
-           'infer_meta', 'data_with_inferred_meta', 'read_and_process_data', 'save_population_h5', 'load_population_h5',
+__all__ = ['stk_loaded_files_set', 'stk_file_map', 'n_sketch_quantiles', 'max_cats', 'custom_meta_key', 'shared_store_dir',
+           'shared_store_refs', 'read_json', 'get_loaded_files', 'reset_file_tracking', 'get_file_map', 'set_file_map',
+           'process_annotated_data', 'read_annotated_data', 'file_fingerprint', 'read_annotated_data_lazy',
+           'fix_df_with_meta', 'extract_column_meta', 'group_columns_dict', 'list_aliases', 'combine_annotated_data',
+           'read_annotated_data_multi', 'change_meta_df', 'replace_data_meta_in_parquet', 'fix_meta_categories',
+           'fix_parquet_categories', 'quantile_sketches', 'add_quantile_sketches', 'infer_meta',
+           'data_with_inferred_meta', 'read_and_process_data', 'save_population_h5', 'load_population_h5',
            'save_sample_h5', 'find_type_in_dict', 'save_parquet_with_metadata', 'load_parquet_metadata',
-           'load_parquet_with_metadata']
+           'load_parquet_with_metadata', 'shared_store_lock', 'shared_store_path', 'parquet_to_arrow_ipc',
+           'shared_store_users', 'shared_store_cleanup', 'shared_store_open', 'shared_store_release']
 
 # %% ../nbs/01_io.ipynb 3
-import json, os, warnings
+import json, os, warnings, hashlib, tempfile, shutil, contextlib, atexit, time, copy
 import itertools as it
 from collections import defaultdict
 
@@ -25,8 +28,12 @@ from typing import List, Tuple, Dict, Union, Optional
 
 import pyarrow as pa
 import pyarrow.parquet as pq
+import pyarrow.compute as pc
 import pyreadstat
 
+try: import fcntl
+except ImportError: fcntl = None # Not on Windows, where the shared store is not locked between processes
+
 import salk_toolkit as stk
 from salk_toolkit.utils import replace_constants, is_datetime, warn, cached_fn
 from salk_toolkit.validation import DataMeta, DataDescription, soft_validate
@@ -305,6 +312,9 @@ def process_annotated_data(meta_fname=None, meta=None, data_file=None, raw_data=
     # Also replaces infer with the actual categories
     fix_meta_categories(meta,ndf,warnings=True)
 
+    # Precompute quantile sketches for continuous columns so they can be discretized without going back to data
+    add_quantile_sketches(meta,ndf,only_missing=virtual_pass)
+
     ndf['original_inds'] = np.arange(len(ndf))
     if 'excluded' in meta and not ignore_exclusions and not virtual_pass:
         excl_inds = [ i for i,_ in meta['excluded'] ]
@@ -336,10 +346,18 @@ def read_annotated_data(fname, infer=True, return_raw=False, return_model_meta=F
     meta = infer_meta(fname,meta_file=False)
     return process_annotated_data(fname, meta=meta, return_meta=True) + mm
 
+# Fingerprint of a file that changes whenever the file does - useful as a cache key for things derived from it
+def file_fingerprint(fname):
+    fst = os.stat(fname)
+    return (os.path.abspath(fname), fst.st_size, fst.st_mtime_ns)
+
 # Return a lazy polars dataframe instead of a pandas one
 # NB! Only does actual lazy loading if the file is a parquet file
-def read_annotated_data_lazy(fname,return_model_meta=False):
-    if fname.endswith('.parquet'): 
+# With shared=True, parquet files are read through the shared store (see shared_store_open) to save memory across processes
+def read_annotated_data_lazy(fname,return_model_meta=False,shared=False):
+    if fname.endswith('.parquet') and shared:
+        ldf, full_meta = shared_store_open(fname)
+    elif fname.endswith('.parquet'): 
         ldf, full_meta = load_parquet_with_metadata(fname,lazy=True)
     else:
         full_df, dmeta, mmeta = read_annotated_data(fname, return_model_meta=True)
@@ -390,6 +408,70 @@ def list_aliases(lst, da):
     return [ fv for v in lst for fv in (da[v] if isinstance(v,str) and v in da else [v]) ]
 
 # %% ../nbs/01_io.ipynb 14
+# Combine several annotated datasets (like waves of a survey, or results of different models) into one lazy dataset
+# Rows get key_col telling which dataset they come from, and columns missing from a dataset are null for its rows
+# Category columns are cast to Enums with the categories of all datasets (in order of first appearance), 
+# or to Categoricals if some dataset does not know its categories in advance.
+# The meta is that of the first dataset, extended with the columns and categories of the others and key_col.
+# Columns missing from some datasets are listed in meta['missing_columns'], so filters on them skip those datasets (see pp_filter_data_lz)
+def combine_annotated_data(ldfs, metas, names, key_col='input_file'):
+    if not (len(ldfs)==len(metas)==len(names)): raise ValueError('Need the same number of datasets, metas and names')
+    schemas, cmetas = [ ldf.collect_schema() for ldf in ldfs ], [ extract_column_meta(m) for m in metas ]
+    all_cols = list(dict.fromkeys(c for s in schemas for c in s.names()))
+    merge = lambda lists: list(dict.fromkeys(v for l in lists for v in l))
+
+    casts = {}
+    for c in all_cols:
+        dtypes = [ s[c] for s in schemas if c in s ]
+        if not any(isinstance(d,(pl.Categorical,pl.Enum)) for d in dtypes) or not all(isinstance(d,(pl.Categorical,pl.Enum,pl.String)) for d in dtypes): continue
+        known = [] # Categories of each dataset with the column, or None if not known in advance
+        for s, cm in zip(schemas, cmetas):
+            if c not in s: continue
+            if isinstance(s[c],pl.Enum): known.append(s[c].categories.to_list())
+            elif isinstance(cm.get(c,{}).get('categories'),list): known.append([ str(v) for v in cm[c]['categories'] ])
+            else: known.append(None)
+        casts[c] = pl.Enum(merge(known)) if None not in known else pl.Categorical
+
+    frames = [ ldf.with_columns([ pl.col(c).cast(pl.String).cast(dt) if isinstance(dt,pl.Enum) else pl.col(c).cast(pl.String) for c, dt in casts.items() if c in s ] +
+                                [ pl.lit(name).cast(pl.Enum(names)).alias(key_col) ])
+               for ldf, s, name in zip(ldfs, schemas, names) ]
+    ldf = pl.concat(frames, how='diagonal_relaxed').with_columns([ pl.col(c).cast(pl.Categorical) for c, dt in casts.items() if dt==pl.Categorical ])
+
+    # Extend the meta of the first dataset with columns only present in the others
+    meta, seen = copy.deepcopy(metas[0]), set(cmetas[0])
+    groups = { g['name']: g for g in meta['structure'] }
+    for m in metas[1:]:
+        for g in m['structure']:
+            prefix = (g.get('scale') or {}).get('col_prefix','')
+            new = [ cd for cd in g['columns'] if prefix+(cd if isinstance(cd,str) else cd[0]) not in seen ]
+            if not new: continue
+            if g['name'] in groups: groups[g['name']]['columns'] += copy.deepcopy(new)
+            else: meta['structure'].append(groups.setdefault(g['name'], { **copy.deepcopy(g), 'columns': copy.deepcopy(new) }))
+            seen |= { prefix+(cd if isinstance(cd,str) else cd[0]) for cd in new }
+
+    # Update categories in the meta to match the Enums
+    for g in meta['structure']:
+        prefix = (g.get('scale') or {}).get('col_prefix','')
+        cnames = [ prefix+(cd if isinstance(cd,str) else cd[0]) for cd in g['columns'] ]
+        if isinstance(g.get('scale',{}).get('categories'), list):
+            g['scale']['categories'] = merge([g['scale']['categories']] + [ casts[c].categories.to_list() for c in cnames if isinstance(casts.get(c),pl.Enum) ])
+        for cn, cd in zip(cnames, g['columns']):
+            if isinstance(cd,list) and isinstance(cd[-1],dict) and isinstance(cd[-1].get('categories'),list) and isinstance(casts.get(cn),pl.Enum):
+                cd[-1]['categories'] = casts[cn].categories.to_list()
+
+    meta['structure'].append({ 'name': key_col, 'columns': [[key_col, { 'categories': list(names) }]] })
+    meta['missing_columns'] = { 'key': key_col, 'columns': { c: [ n for n, s in zip(names, schemas) if c not in s ]
+                                                             for c in all_cols if any(c not in s for s in schemas) } }
+    if all('total_size' in m for m in metas): meta['total_size'] = sum(m['total_size'] for m in metas)
+    return ldf, meta
+
+# Read several annotated data files as one lazy dataset (see combine_annotated_data), named by their file names unless names are given
+def read_annotated_data_multi(fnames, names=None, key_col='input_file', shared=False):
+    loaded = [ read_annotated_data_lazy(fn, shared=shared) for fn in fnames ]
+    names = names or [ os.path.basename(fn) for fn in fnames ]
+    return combine_annotated_data([ l[0] for l in loaded ], [ l[1] for l in loaded ], names, key_col)
+
+# %% ../nbs/01_io.ipynb 16
 # Creates a mapping old -> new
 def get_original_column_names(dmeta):
     res = {}
@@ -410,7 +492,7 @@ def change_mapping(ot, nt, only_matches=False):
                  **{ k:v for k, v in nt.items() if k not in ot }, # do those in nt not in ot
                  **matches } 
 
-# %% ../nbs/01_io.ipynb 15
+# %% ../nbs/01_io.ipynb 17
 # Change an existing dataset to correspond better to a new meta_data
 # This is intended to allow making small improvements in the meta even after a model has been run
 # It is by no means perfect, but is nevertheless a useful tool to avoid re-running long pymc models for simple column/translation changes
@@ -491,7 +573,7 @@ def replace_data_meta_in_parquet(parquet_name,metafile_name,advanced=True):
     return df, meta
 
 
-# %% ../nbs/01_io.ipynb 16
+# %% ../nbs/01_io.ipynb 18
 # A function to infer categories (and validate the ones already present)
 # Works in-place
 def fix_meta_categories(data_meta, df, infers_only=False, warnings=True):
@@ -528,12 +610,55 @@ def fix_parquet_categories(parquet_name):
     meta['data'] = fix_meta_categories(meta['data'],df,infers_only=False)
     save_parquet_with_metadata(df,meta,parquet_name)
 
-# %% ../nbs/01_io.ipynb 17
+# %% ../nbs/01_io.ipynb 19
+n_sketch_quantiles = 100
+
+# Compute exact quantile sketches, i.e. values at evenly spaced quantiles from min to max, for numeric columns
+# One sort per column gives all quantiles at once. Empty and non-numeric columns are skipped
+# With sample given, only every k-th value is sorted so that at most about 2*sample values are, which keeps the result deterministic
+# Min and max are always exact
+def quantile_sketches(df, cols, n_quantiles=n_sketch_quantiles, sample=None):
+    ldf = df.select(cols) if isinstance(df,pl.LazyFrame) else pl.from_pandas(df[cols]).lazy()
+    schema = ldf.collect_schema()
+    cols = [ c for c in cols if schema[c].is_numeric() ]
+    if not cols: return {}
+
+    stats = ldf.select(pl.col(cols).count(), pl.col(cols).min().name.suffix('_min'), pl.col(cols).max().name.suffix('_max')).collect().row(0,named=True)
+    cols = [ c for c in cols if stats[c]>0 ]
+    qs = pl.Series(np.linspace(0,1,n_quantiles+1))
+    vals = [ pl.col(c).drop_nulls().gather_every(max(1,stats[c]//sample) if sample else 1) for c in cols ]
+    sketches = ldf.select([ v.sort().gather(((v.len()-1)*qs).round().cast(pl.Int64)) for v in vals ]).collect()
+    return { c: [ float(stats[c+'_min']), *map(float,sketches[c][1:-1]), float(stats[c+'_max']) ] for c in cols }
+
+# Add quantile sketches for continuous columns to data_meta (in-place)
+# These are stored in data_meta (in-place) so numeric columns can be discretized with stable breaks without looking at the data
+def add_quantile_sketches(data_meta, df, cols=None, only_missing=False, n_quantiles=n_sketch_quantiles):
+    if 'structure' not in data_meta: return data_meta
+    c_meta = extract_column_meta(data_meta)
+    
+    df_cols = df.collect_schema().names() if isinstance(df,pl.LazyFrame) else list(df.columns)
+    if cols is None: cols = [ c for c in df_cols if c_meta[c].get('continuous') and 'columns' not in c_meta[c] ]
+    cols = [ c for c in cols if c in df_cols and not (only_missing and 'quantiles' in c_meta[c]) ]
+    
+    sketches = quantile_sketches(df, cols, n_quantiles)
+    
+    for g in data_meta['structure']:
+        prefix = (g.get('scale') or {}).get('col_prefix','')
+        for i, c in enumerate(g.get('columns',[])):
+            cn = prefix + (c if isinstance(c,str) else c[0])
+            if cn not in sketches: continue
+            if isinstance(c,str) or not isinstance(c[-1],dict): # Add a meta dict to column spec if missing
+                c = g['columns'][i] = ([c] if isinstance(c,str) else list(c)) + [{}]
+            c[-1]['quantiles'] = sketches[cn]
+
+    return data_meta
+
+# %% ../nbs/01_io.ipynb 21
 def is_categorical(col):
     return col.dtype.name in ['object', 'str', 'category'] and not is_datetime(col)
 
 
-# %% ../nbs/01_io.ipynb 18
+# %% ../nbs/01_io.ipynb 22
 max_cats = 50
 
 # Create a very basic metafile for a dataset based on it's contents
@@ -653,7 +778,7 @@ def data_with_inferred_meta(data_file, **kwargs):
     return process_annotated_data(meta=meta, data_file=data_file, return_meta=True)
 
 
-# %% ../nbs/01_io.ipynb 20
+# %% ../nbs/01_io.ipynb 24
 def perform_merges(df,merges,constants={}):
     if not isinstance(merges,list): merges = [merges]
     for ms in merges:
@@ -670,7 +795,7 @@ def perform_merges(df,merges,constants={}):
         df = mdf
     return df
 
-# %% ../nbs/01_io.ipynb 21
+# %% ../nbs/01_io.ipynb 25
 def read_and_process_data(desc, return_meta=False, constants={}, skip_postprocessing=False, **kwargs):
 
     if isinstance(desc,str): desc = { 'file':desc } # Allow easy shorthand for simple cases
@@ -693,7 +818,7 @@ def read_and_process_data(desc, return_meta=False, constants={}, skip_postproces
     
     return (df, meta) if return_meta else df
 
-# %% ../nbs/01_io.ipynb 23
+# %% ../nbs/01_io.ipynb 27
 def save_population_h5(fname,pdf):
     hdf = pd.HDFStore(fname,complevel=9, complib='zlib')
     hdf.put('population',pdf,format='table')
@@ -705,7 +830,7 @@ def load_population_h5(fname):
     hdf.close()
     return res
 
-# %% ../nbs/01_io.ipynb 24
+# %% ../nbs/01_io.ipynb 28
 def save_sample_h5(fname,trace,COORDS = None, filter_df = None):
     odims = [d for d in trace.predictions.dims if d not in ['chain','draw','obs_idx']]
     
@@ -746,7 +871,7 @@ def save_sample_h5(fname,trace,COORDS = None, filter_df = None):
     hdf.close()
 
 
-# %% ../nbs/01_io.ipynb 25
+# %% ../nbs/01_io.ipynb 29
 # Small debug tool to help find where jsons become non-serializable
 def find_type_in_dict(d,dtype,path=''):
     print(d,path)
@@ -759,25 +884,35 @@ def find_type_in_dict(d,dtype,path=''):
     elif isinstance(d,dtype):
         raise Exception(f"Value {d} of type {dtype} found at {path}")
 
-# %% ../nbs/01_io.ipynb 26
+# %% ../nbs/01_io.ipynb 30
 # These two very helpful functions are borrowed from https://towardsdatascience.com/saving-metadata-with-dataframes-71f51f558d8e
 
 custom_meta_key = 'salk-toolkit-meta'
 
+# df can also be an iterable of dataframe chunks (with the same columns and types), which are then written one at a time
+# This allows writing files that do not fit into memory
 def save_parquet_with_metadata(df, meta, file_name):
-    table = pa.Table.from_pandas(df)
-
     #find_type_in_dict(meta,np.int64)
-    
     custom_meta_json = json.dumps(meta)
-    existing_meta = table.schema.metadata
-    combined_meta = {
-        custom_meta_key.encode() : custom_meta_json.encode(),
-        **existing_meta
-    }
-    table = table.replace_schema_metadata(combined_meta)
-    
-    pq.write_table(table, file_name, compression='GZIP')
+    combine_meta = lambda table: { custom_meta_key.encode() : custom_meta_json.encode(), **(table.schema.metadata or {}) }
+
+    if isinstance(df, pd.DataFrame):
+        table = pa.Table.from_pandas(df)
+        table = table.replace_schema_metadata(combine_meta(table))
+        pq.write_table(table, file_name, compression='GZIP')
+        return
+
+    writer = None
+    try:
+        for chunk in df:
+            table = pa.Table.from_pandas(chunk, preserve_index=False) # Index of chunks would not add up
+            if writer is None:
+                schema = table.schema.with_metadata(combine_meta(table))
+                writer = pq.ParquetWriter(file_name, schema, compression='GZIP')
+            writer.write_table(table.replace_schema_metadata(schema.metadata))
+    finally:
+        if writer is not None: writer.close()
+    if writer is None: raise ValueError('No data chunks to save')
     
 # Just load the metadata from the parquet file
 def load_parquet_metadata(file_name):
@@ -806,3 +941,104 @@ def load_parquet_with_metadata(file_name,lazy=False,**kwargs):
     return restored_df, restored_meta
 
 
+
+# %% ../nbs/01_io.ipynb 32
+# Shared dataset store: annotated parquet files are decoded once per host into uncompressed Arrow IPC files,
+# which polars memory maps, so all processes using the same data file share a single copy of it in the page cache
+# Store files live in shared memory (/dev/shm) where available. Each process registers itself as a user of the file it opens
+# and files no longer used by any live process, like those made from older versions of a data file, are removed
+shared_store_dir = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'salk_toolkit_store')
+shared_store_refs = defaultdict(int) # Number of times each store file is open in this process
+
+@contextlib.contextmanager
+def shared_store_lock(store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, '.lock'), 'w') as lf:
+        if fcntl: fcntl.flock(lf, fcntl.LOCK_EX)
+        yield
+
+# Store files are named by the data file and its version, so older versions of the same file are easy to find
+def shared_store_path(fname, store_dir=None):
+    fp = file_fingerprint(fname)
+    h = lambda o: hashlib.sha256(json.dumps(o).encode()).hexdigest()[:16]
+    return os.path.join(store_dir or shared_store_dir, f'{h(fp[0])}-{h(fp)}.arrow')
+
+# Convert a parquet file to an Arrow IPC file in batches, so it does not need to fit into memory
+# IPC files can not change dictionaries between batches, so categorical columns are first given dictionaries covering all batches
+def parquet_to_arrow_ipc(fname, out_fname):
+    pf = pq.ParquetFile(fname)
+    schema = pf.schema_arrow
+    dict_cols = [ f.name for f in schema if pa.types.is_dictionary(f.type) ]
+
+    dicts = { c: {} for c in dict_cols }
+    for batch in (pf.iter_batches(columns=dict_cols) if dict_cols else []):
+        for c in dict_cols: dicts[c].update(dict.fromkeys(batch.column(c).dictionary.to_pylist()))
+    dicts = { c: pa.array(list(d), type=schema.field(c).type.value_type) for c, d in dicts.items() }
+
+    def unify(arr, c):
+        indices = pc.take(pc.index_in(arr.dictionary, value_set=dicts[c]), arr.indices)
+        return pa.DictionaryArray.from_arrays(indices, dicts[c], ordered=schema.field(c).type.ordered)
+
+    with pa.OSFile(out_fname, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in pf.iter_batches():
+            writer.write_batch(pa.RecordBatch.from_arrays([ unify(batch.column(c), c) if c in dicts else batch.column(c) for c in schema.names ], schema=schema))
+
+# Users of a store file are recorded as files named by their pid, so users that died without releasing it are detected
+def shared_store_users(path):
+    def alive(pid):
+        try: os.kill(pid, 0)
+        except ProcessLookupError: return False
+        except PermissionError: pass # Process of another user
+        return True
+    refs = path + '.refs'
+    return [ int(p) for p in (os.listdir(refs) if os.path.isdir(refs) else []) if alive(int(p)) ]
+
+# Remove store files (optionally only those matching a prefix) that have no live users
+def shared_store_cleanup(store_dir=None, prefix=''):
+    store_dir = store_dir or shared_store_dir
+    with shared_store_lock(store_dir):
+        for fn in os.listdir(store_dir):
+            path = os.path.join(store_dir, fn)
+            if not fn.endswith('.arrow') or not fn.startswith(prefix) or shared_store_users(path): continue
+            shutil.rmtree(path + '.refs', ignore_errors=True)
+            os.remove(path)
+
+# Open a parquet data file through the shared store, returning a memory mapped lazy frame and the metadata of the file
+# Opening a newer version of a file releases the older ones held by this process
+def shared_store_open(fname, store_dir=None):
+    store_dir = store_dir or shared_store_dir
+    path = shared_store_path(fname, store_dir)
+    prefix = os.path.basename(path).split('-')[0]
+
+    for old in [ p for p in shared_store_refs if os.path.dirname(p)==store_dir and os.path.basename(p).startswith(prefix) and p!=path ]:
+        shared_store_release(old)
+
+    with shared_store_lock(store_dir):
+        if shared_store_refs[path]==0:
+            os.makedirs(path + '.refs', exist_ok=True)
+            open(os.path.join(path + '.refs', str(os.getpid())), 'w').close()
+        shared_store_refs[path] += 1
+        exists = os.path.exists(path)
+
+    if not exists: # Write to a temporary file first, so other processes never see a partial file
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try: parquet_to_arrow_ipc(fname, tmp); os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+    shared_store_cleanup(store_dir, prefix) # Older versions of the file
+
+    return pl.scan_ipc(path, memory_map=True), load_parquet_metadata(fname)
+
+# Stop using a store file in this process. The file is removed once it has no users left
+# Data already read from it stays valid, as the memory map keeps the file alive
+def shared_store_release(path):
+    if shared_store_refs.get(path, 0)==0: return
+    shared_store_refs[path] -= 1
+    if shared_store_refs[path]>0: return
+    del shared_store_refs[path]
+    with shared_store_lock(os.path.dirname(path)):
+        ref = os.path.join(path + '.refs', str(os.getpid()))
+        if os.path.exists(ref): os.remove(ref)
+    shared_store_cleanup(os.path.dirname(path), os.path.basename(path).split('.')[0])
+
+atexit.register(lambda: [ shared_store_release(p) for p in list(shared_store_refs) for _ in range(shared_store_refs[p]) ])
@@ -3,11 +3,11 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/03_plots.ipynb.
 
 # %% auto 0
-__all__ = ['estimate_legend_columns_horiz_naive', 'estimate_legend_columns_horiz', 'boxplot_vals', 'boxplot_manual', 'columns',
-           'stacked_columns', 'diff_columns', 'massplot', 'make_start_end', 'likert_bars', 'kde_bw', 'kde_1d',
-           'density', 'violin', 'cluster_based_reorder', 'matrix', 'corr_matrix', 'lines', 'draws_to_hdis', 'lines_hdi',
-           'area_smooth', 'likert_aggregate', 'likert_rad_pol', 'barbell', 'geoplot', 'geobest', 'fd_mangle',
-           'facet_dist', 'ordered_population', 'marimekko']
+__all__ = ['estimate_legend_columns_horiz_naive', 'estimate_legend_columns_horiz', 'boxplot_vals', 'boxplot_stats',
+           'boxplot_manual', 'columns', 'stacked_columns', 'diff_columns', 'massplot', 'make_start_end', 'likert_bars',
+           'kde_bw', 'kde_1d', 'density', 'violin', 'cluster_based_reorder', 'matrix', 'corr_matrix', 'lines',
+           'draws_to_hdis', 'lines_hdi', 'area_smooth', 'likert_aggregate', 'likert_rad_pol', 'barbell', 'geoplot',
+           'geobest', 'fd_mangle', 'facet_dist', 'ordered_population', 'marimekko']
 
 # %% ../nbs/03_plots.ipynb 3
 import json, os, math
@@ -16,6 +16,7 @@ from collections import defaultdict
 
 import numpy as np
 import pandas as pd
+import polars as pl
 import datetime as dt
 
 from typing import List, Tuple, Dict, Union, Optional
@@ -30,7 +31,7 @@ import arviz as az
 
 from salk_toolkit.utils import *
 from salk_toolkit.io import extract_column_meta, read_json
-from salk_toolkit.pp import registry, registry_meta, e2e_plot, stk_plot
+from salk_toolkit.pp import registry, registry_meta, e2e_plot, stk_plot, summarize_draws
 
 from matplotlib import font_manager
 from PIL import ImageFont
@@ -92,21 +93,30 @@ def boxplot_vals(s,extent=1.5):
         'tmax': s[s<q3+extent*(q3-q1)].max()
     },index=['row'])
 
+# Same statistics as boxplot_vals for all groups of f_cols at once, computed with polars like the summary data from pp
+# The values are renamed first, as raw data can have a value column with the name of a statistic (like q1)
+def boxplot_stats(data, f_cols, value_col, extent=1.5):
+    ldf = pl.from_pandas(data[f_cols+[value_col]].set_axis(f_cols+['__value'], axis=1), nan_to_null=True).lazy().drop_nulls(f_cols) # Null groups are dropped, as in groupby
+    stats = summarize_draws(ldf, f_cols, '__value', extent=extent).sort(f_cols).collect()
+    return stats.select(f_cols+['min','q1','median','q3','max','tmin','tmax']).to_pandas()
 
-@stk_plot('boxplots', data_format='longform', draws=True, n_facets=(1,2), priority=50, group_sizes=True, args={'fit_beta_dist':'bool'})
-def boxplot_manual(data, value_col='value', facets=[], val_format='%', width=800, tooltip=[], outer_factors=[], fit_beta_dist=False):
+
+@stk_plot('boxplots', data_format='summary', draws=True, n_facets=(1,2), priority=50, group_sizes=True, args={'fit_beta_dist':'bool'}, longform_args=['fit_beta_dist'])
+def boxplot_manual(data, value_col='value', facets=[], val_format='%', width=800, tooltip=[], outer_factors=[], fit_beta_dist=False, summary=False):
     f0, f1 = facets[0], facets[1] if len(facets)>1 else None
+    val_cols = ['min','q1','median','q3','max','tmin','tmax'] if summary else [value_col]
 
     if val_format[-1] == '%': # Boxplots being a compound plot, this workaround is needed for axis & tooltips to be proper
-        data[value_col]*=100
+        data[val_cols]*=100
         val_format = val_format[:-1]+'f'
     else: fit_beta_dist = False # Only use beta binomial for categoricals 
 
     f_cols = outer_factors+[f['col'] for f in facets[:2] if f is not None]
-    if fit_beta_dist: 
+    if summary: df = data.dropna(subset=f_cols) # Drop null groups like groupby below does
+    elif fit_beta_dist: 
         data['count'] = (data['group_size']*(data[value_col]/100)).round(0).astype('int')
         df = beta_binomial_fit(data,f_cols)
-    else: df = data.groupby(f_cols,observed=True)[value_col].apply(boxplot_vals).reset_index()
+    else: df = boxplot_stats(data, f_cols, value_col)
     
     shared = {'y': alt.Y(f'{f0["col"]}:N', title=None, sort=f0['order']),
               **({'yOffset':alt.YOffset(f'{f1["col"]}:N', title=None, sort=f1['order'])} if f1 else {}),
@@ -150,8 +160,8 @@ def boxplot_manual(data, value_col='value', facets=[], val_format='%', width=800
 # Also create a raw version for the same plot 
 stk_plot('boxplots-raw', data_format="raw", n_facets=(1,2), priority=0)(boxplot_manual)
 
-# %% ../nbs/03_plots.ipynb 16
-@stk_plot('columns', data_format='longform', draws=False, n_facets=(1,2))
+# %% ../nbs/03_plots.ipynb 17
+@stk_plot('columns', data_format='longform', draws=False, n_facets=(1,2), native=True)
 def columns(data, value_col='value', facets=[], val_format='%', width=800, tooltip=[]):
     f0, f1 = facets[0], facets[1] if len(facets)>1 else None
     plot = alt.Chart(data).mark_bar().encode(
@@ -172,7 +182,7 @@ def columns(data, value_col='value', facets=[], val_format='%', width=800, toolt
     )
     return plot
 
-# %% ../nbs/03_plots.ipynb 19
+# %% ../nbs/03_plots.ipynb 20
 @stk_plot('stacked_columns', data_format='longform', draws=False, nonnegative=True, n_facets=(2,2), agg_fn='sum', args={'normalized':'bool'})
 def stacked_columns(data, value_col='value', facets=[], filtered_size=1, val_format='%', width=800, normalized=False, tooltip=[]):
     f0, f1 = facets[0], facets[1]
@@ -203,7 +213,7 @@ def stacked_columns(data, value_col='value', facets=[], filtered_size=1, val_for
     )
     return plot
 
-# %% ../nbs/03_plots.ipynb 21
+# %% ../nbs/03_plots.ipynb 22
 @stk_plot('diff_columns', data_format='longform', draws=False, n_facets=(2,2), args={'sort_descending':'bool'})
 def diff_columns(data, value_col='value', facets=[], val_format='%', sort_descending=False, tooltip=[]):
     f0, f1 = facets[0], facets[1]
@@ -234,7 +244,7 @@ def diff_columns(data, value_col='value', facets=[], val_format='%', sort_descen
     )
     return plot
 
-# %% ../nbs/03_plots.ipynb 23
+# %% ../nbs/03_plots.ipynb 24
 # The idea was to also visualize the size of each cluster. Currently not very useful, may need to be rethought
 
 @stk_plot('massplot', data_format='longform', draws=False, group_sizes=True, n_facets=(1,2), hidden=True)
@@ -270,7 +280,7 @@ def massplot(data, value_col='value', facets=[], filtered_size=1, val_format='%'
     )
     return plot
 
-# %% ../nbs/03_plots.ipynb 25
+# %% ../nbs/03_plots.ipynb 26
 # Make the likert bar pieces
 def make_start_end(x,value_col,cat_col,cat_order):
     #print("######################")
@@ -333,7 +343,7 @@ def likert_bars(data, value_col='value', facets=[],  tooltip=[], outer_factors=[
         )
     return plot
 
-# %% ../nbs/03_plots.ipynb 29
+# %% ../nbs/03_plots.ipynb 30
 # Calculate the bandwidth for KDE
 def kde_bw(ar):
     # Lower-bound silverman by min_diff to smooth out categorical density plots
@@ -396,7 +406,7 @@ def density(data, value_col='value', facets=[], tooltip=[], outer_factors=[], st
 # Also create a raw version for the same plot 
 stk_plot('density-raw', data_format="raw", factor_columns=3, aspect_ratio=(1.0/1.0), n_facets=(0,1), args={'stacked':'bool', 'bw':'float'}, no_question_facet=True, priority=0)(density)
 
-# %% ../nbs/03_plots.ipynb 31
+# %% ../nbs/03_plots.ipynb 32
 @stk_plot('violin', n_facets=(1,2), draws=True, as_is=True, args={'bw':'float'})
 def violin(data, value_col='value', facets=[], tooltip=[], outer_factors=[], bw=None, width=800):
     f0, f1 = facets[0], facets[1] if len(facets)>1 else None
@@ -426,7 +436,7 @@ def violin(data, value_col='value', facets=[], tooltip=[], outer_factors=[], bw=
 # Also create a raw version for the same plot 
 stk_plot('violin-raw', data_format='raw', n_facets=(1,2), as_is=True, args={'bw':'float'})(violin)
 
-# %% ../nbs/03_plots.ipynb 33
+# %% ../nbs/03_plots.ipynb 34
 # Cluster-based reordering
 def cluster_based_reorder(X):
     pd = sp.spatial.distance.pdist(X)#,metric='cosine')
@@ -478,7 +488,7 @@ def matrix(data, value_col='value', facets=[], val_format='%', reorder=False, lo
         
     return plot
 
-# %% ../nbs/03_plots.ipynb 37
+# %% ../nbs/03_plots.ipynb 38
 @stk_plot('corr_matrix', data_format='raw', aspect_ratio=(1/0.8), n_facets=(1,1))
 def corr_matrix(data, value_col='value', facets=[], val_format='%', reorder=False, tooltip=[]):
     if 'id' not in data.columns: raise Exception("Corr_matrix only works for groups of continuous variables")
@@ -494,8 +504,8 @@ def corr_matrix(data, value_col='value', facets=[], val_format='%', reorder=Fals
     return matrix(cm_long, value_col=value_col, facets=[{'col':'index','order':facets[0]['order']},{'col':facets[0]['col'],'order':facets[0]['order']}], val_format=val_format,
                   tooltip=[alt.Tooltip(f'{value_col}:Q'),alt.Tooltip('index:N'),alt.Tooltip(f"{facets[0]['col']}:N")])
 
-# %% ../nbs/03_plots.ipynb 39
-@stk_plot('lines',data_format='longform', draws=False, requires=[{},{'ordered':True}], n_facets=(2,2), args={'smooth':'bool'})
+# %% ../nbs/03_plots.ipynb 40
+@stk_plot('lines',data_format='longform', draws=False, requires=[{},{'ordered':True}], n_facets=(2,2), args={'smooth':'bool'}, native=True)
 def lines(data, value_col='value', facets=[], smooth=False, width=800, tooltip=[], val_format='.2f',):
     f0, f1 = facets[0], facets[1]
     if smooth:
@@ -513,7 +523,7 @@ def lines(data, value_col='value', facets=[], smooth=False, width=800, tooltip=[
     )
     return plot
 
-# %% ../nbs/03_plots.ipynb 41
+# %% ../nbs/03_plots.ipynb 42
 def draws_to_hdis(data,vc,hdi_vals):
     gbc = [ c for c in data.columns if c not in [vc,'draw'] ]
     ldfs = []
@@ -525,11 +535,12 @@ def draws_to_hdis(data,vc,hdi_vals):
     df = ldf.pivot(index=gbc+['hdi'], columns=ldf.columns[-3],values=vc).reset_index()
     return df
 
-@stk_plot('lines_hdi',data_format='longform', draws=True, requires=[{},{'ordered':True}], n_facets=(2,2), args={'hdi1':'float','hdi2':'float'})
-def lines_hdi(data, value_col='value', facets=[], width=800, tooltip=[], val_format='.2f', hdi1=0.94, hdi2=0.5):
+@stk_plot('lines_hdi',data_format='summary', hdi_args=['hdi1','hdi2'], draws=True, requires=[{},{'ordered':True}], n_facets=(2,2), args={'hdi1':'float','hdi2':'float'})
+def lines_hdi(data, value_col='value', facets=[], width=800, tooltip=[], val_format='.2f', hdi1=0.94, hdi2=0.5, summary=False):
     f0, f1 = facets[0], facets[1]
     
-    hdf = draws_to_hdis(data,value_col,[hdi1,hdi2])
+    if summary: hdf = data.dropna(subset=[f['col'] for f in facets]) # HDIs are usually computed by pp
+    else: hdf = draws_to_hdis(data,value_col,[hdi1,hdi2])
     # Draw them in reverse order so the things that are first (i.e. most important) are drawn last (i.e. on top of others)
     # Also draw wider hdi before the narrower
     hdf.sort_values([f0["col"],'hdi'],ascending=[False,False],inplace=True)
@@ -554,7 +565,7 @@ def lines_hdi(data, value_col='value', facets=[], width=800, tooltip=[], val_for
         )
     return plot
 
-# %% ../nbs/03_plots.ipynb 43
+# %% ../nbs/03_plots.ipynb 44
 @stk_plot('area_smooth',data_format='longform', draws=False, nonnegative=True, requires=[{},{'ordered':True}], n_facets=(2,2))
 def area_smooth(data, value_col='value', facets=[], width=800, tooltip=[]):
     f0, f1 = facets[0], facets[1]
@@ -575,7 +586,7 @@ def area_smooth(data, value_col='value', facets=[], width=800, tooltip=[]):
         )
     return plot
 
-# %% ../nbs/03_plots.ipynb 45
+# %% ../nbs/03_plots.ipynb 46
 def likert_aggregate(x, cat_col, cat_order, value_col):
     
     cc, vc = x[cat_col], x[value_col]
@@ -628,8 +639,8 @@ def likert_rad_pol(data, value_col='value', facets=[], normalized=True, width=80
     
     return plot
 
-# %% ../nbs/03_plots.ipynb 47
-@stk_plot('barbell', data_format='longform', draws=False, n_facets=(2,2))
+# %% ../nbs/03_plots.ipynb 48
+@stk_plot('barbell', data_format='longform', draws=False, n_facets=(2,2), native=True)
 def barbell(data, value_col='value', facets=[], filtered_size=1, val_format='%', width=800, tooltip=[]):
     f0, f1 = facets[0], facets[1]
     
@@ -662,7 +673,7 @@ def barbell(data, value_col='value', facets=[], filtered_size=1, val_format='%',
     
     return chart
 
-# %% ../nbs/03_plots.ipynb 50
+# %% ../nbs/03_plots.ipynb 51
 @stk_plot('geoplot', data_format='longform', n_facets=(1,1), requires=[{'topo_feature':'pass'}], no_faceting=True, aspect_ratio=(4.0/3.0), no_question_facet=True, args={'separate_axes':'bool'})
 def geoplot(data, topo_feature, value_col='value', facets=[], val_format='.2f', tooltip=[],
                 separate_axes=False, outer_factors=[], outer_colors={}, value_range=None):
@@ -722,7 +733,7 @@ def geoplot(data, topo_feature, value_col='value', facets=[], val_format='.2f',
     ).project('mercator')
     return plot
 
-# %% ../nbs/03_plots.ipynb 51
+# %% ../nbs/03_plots.ipynb 52
 @stk_plot('geobest', data_format='longform', n_facets=(2,2), requires=[{},{'topo_feature':'pass'}], no_faceting=True,aspect_ratio=(4.0/3.0))
 def geobest(data, topo_feature, value_col='value', facets=[], val_format='.2f', tooltip=[], width=800):
     f0, f1 = facets[0], facets[1]
@@ -754,7 +765,7 @@ def geobest(data, topo_feature, value_col='value', facets=[], val_format='.2f',
     ).project('mercator')
     return plot
 
-# %% ../nbs/03_plots.ipynb 55
+# %% ../nbs/03_plots.ipynb 56
 # Assuming ns is ordered by unique row values, find the split points
 def split_ordered(cvs):
     if len(cvs.shape)==1: cvs = cvs[:,None]
@@ -770,7 +781,7 @@ def split_even_weight(ws, n):
     cws = (cws/(cws[-1]/n)).astype('int')
     return (split_ordered(cws)+1)[:-1]
 
-# %% ../nbs/03_plots.ipynb 57
+# %% ../nbs/03_plots.ipynb 58
 def fd_mangle(vc, value_col, factor_col, n_points=10): 
     
     vc = vc.sort_values(value_col)
@@ -802,7 +813,7 @@ def facet_dist(data, value_col='value',facets=[], tooltip=[], outer_factors=[]):
 
     return plot
 
-# %% ../nbs/03_plots.ipynb 59
+# %% ../nbs/03_plots.ipynb 60
 # Vectorized multinomial sampling. Should be slightly faster
 def vectorized_mn(prob_matrix):
     s = prob_matrix.cumsum(axis=1)
@@ -848,7 +859,7 @@ def linevals(vals, value_col, n_points, dim, cats, ccodes=None, ocols=None, boos
 
     return pdf
 
-# %% ../nbs/03_plots.ipynb 60
+# %% ../nbs/03_plots.ipynb 61
 @stk_plot('ordered_population', data_format='raw', factor_columns=3, aspect_ratio=(1.0/1.0), plot_args={'group_categories':'bool'}, n_facets=(0,1), no_question_facet=True)
 def ordered_population(data, value_col='value', facets=[], tooltip=[], outer_factors=[], group_categories=False):
     f0 = facets[0] if len(facets)>0 else None
@@ -931,7 +942,7 @@ def ordered_population(data, value_col='value', facets=[], tooltip=[], outer_fac
     )
     return plot
 
-# %% ../nbs/03_plots.ipynb 62
+# %% ../nbs/03_plots.ipynb 63
 @stk_plot('marimekko', data_format='longform', draws=False, group_sizes=True, args={'separate':'bool'}, n_facets=(2,2))
 def marimekko(data, value_col='value', facets=[], val_format='%', width=800, tooltip=[], outer_factors=[], separate=False):
     f0, f1 = facets[0], facets[1]
@@ -999,7 +1010,7 @@ def marimekko(data, value_col='value', facets=[], val_format='%', width=800, too
     
     return plot
 
-# %% ../nbs/03_plots.ipynb 68
+# %% ../nbs/03_plots.ipynb 69
 # Beta binomial fitting using PyMC with a partially pooled model
 use_partial_pooling = False # bypass pymc and just use method of moments
 
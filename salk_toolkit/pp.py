@@ -3,13 +3,22 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/02_pp.ipynb.
 
 # %% auto 0
-__all__ = ['special_columns', 'registry', 'registry_meta', 'stk_plot_defaults', 'n_a', 'priority_weights',
-           'cont_transform_options', 'get_cat_num_vals', 'stk_plot', 'stk_deregister', 'get_plot_fn', 'get_plot_meta',
-           'get_all_plots', 'calculate_priority', 'matching_plots', 'pp_transform_data', 'create_plot',
-           'impute_factor_cols', 'e2e_plot', 'test_new_plot']
+__all__ = ['current_trace', 'special_columns', 'summary_stats', 'registry', 'registry_meta', 'registry_buckets',
+           'capability_cache', 'stk_plot_defaults', 'n_a', 'priority_weights', 'capability_cache_size',
+           'cont_transform_options', 'translation_tables', 'translation_tables_size', 'spec_cache', 'spec_cache_size',
+           'async_plot_limit', 'async_semaphores', 'plot_trace', 'trace_rss_mb', 'trace_start', 'trace_end',
+           'trace_span', 'traced', 'trace_collect', 'trace_to_chrome', 'get_cat_num_vals', 'stk_plot', 'stk_deregister',
+           'reset_plot_matching', 'get_plot_fn', 'get_plot_meta', 'get_all_plots', 'calculate_priority',
+           'get_registry_buckets', 'capability_index', 'columns_min', 'matching_plots', 'pp_transform_data',
+           'pp_transform_data_progressive', 'TranslationTable', 'get_translation_table', 'PlotMatrix', 'PlotMatrixRow',
+           'create_plot', 'vl_csv_data', 'replace_plot_data', 'plot_to_spec', 'spec_cache_key', 'create_plot_spec',
+           'prune_filter', 'pp_transform_data_many', 'create_plot_many', 'impute_factor_cols', 'e2e_plot',
+           'e2e_prepare', 'test_new_plot', 'async_semaphore', 'with_string_cache', 'run_in_executor',
+           'async_pp_transform_data', 'async_create_plot_spec', 'async_e2e_plot']
 
 # %% ../nbs/02_pp.ipynb 3
-import json, os
+import json, os, copy, inspect, hashlib, threading, contextlib, concurrent.futures, asyncio, functools, weakref, contextvars, time
+import psutil
 import itertools as it
 from collections import defaultdict
 
@@ -24,35 +33,137 @@ from typing import List, Tuple, Dict, Union, Optional
 import altair as alt
 
 from salk_toolkit.utils import *
-from salk_toolkit.io import load_parquet_with_metadata, extract_column_meta, group_columns_dict, list_aliases, read_annotated_data, read_json, read_annotated_data_lazy
+from salk_toolkit.io import load_parquet_with_metadata, extract_column_meta, group_columns_dict, list_aliases, read_annotated_data, read_json, read_annotated_data_lazy, quantile_sketches, file_fingerprint
 
 # %% ../nbs/02_pp.ipynb 6
-# Augment each draw with bootstrap data from across whole population to make sure there are at least <threshold> samples
-def augment_draws(data, factors=None, n_draws=None, threshold=50):
-    if n_draws == None: n_draws = data.draw.max()+1
-    
-    if factors: # Run recursively on each factor separately and concatenate results
-        if data[ ['draw']+factors ].value_counts().min() >= threshold: return data # This takes care of large datasets fast
-        return data.groupby(factors,observed=False).apply(augment_draws,n_draws=n_draws,threshold=threshold).reset_index(drop=True) # Slow-ish, but only needed on small data now
-    
-    # Get count of values for each draw
-    draw_counts = data['draw'].value_counts() # Get value counts of existing draws
-    if len(draw_counts)<n_draws: # Fill in completely missing draws
-        draw_counts = (draw_counts + pd.Series(0,index=range(n_draws))).fillna(0).astype(int)
-        
-    # If no new draws needed, just return original
-    if draw_counts.min()>=threshold: return data
-    
-    # Generate an index for new draws
-    new_draws = [ d for d,c in draw_counts[draw_counts<threshold].items() for _ in range(threshold-c) ]
+# Tracing of the plot pipeline. Inside plot_trace(), each stage records a span with its timing, memory use and row counts
+# Outside of it all tracing calls return right away, so the instrumentation costs next to nothing
+# Spans record their parent, so a trace can be viewed as a tree. Threads started with a copy of the context (as in
+# pp_transform_data_many) add their spans to the same trace
+current_trace = contextvars.ContextVar('current_trace', default=None) # (trace, id of the current span)
+
+# explain: store the query plan of each collect, profile: collect with polars profile() and store the timings of plan nodes
+@contextlib.contextmanager
+def plot_trace(explain=True, profile=False, memory=True):
+    trace = { 'spans': [], 'explain': explain, 'profile': profile, 'memory': memory,
+              't0': time.perf_counter(), 'ids': it.count() }
+    token = current_trace.set((trace, None))
+    try: yield trace
+    finally:
+        current_trace.reset(token); del trace['ids']
+        for span in trace['spans']: span.pop('_token', None) # Spans interrupted by an exception
+
+def trace_rss_mb():
+    return psutil.Process().memory_info().rss / 1024**2
+
+# Start a span, returning it (or None if not tracing). Info given is stored in the span and more can be added to it later
+def trace_start(name, **info):
+    state = current_trace.get()
+    if state is None: return None
+    trace, parent = state
+    span = { 'id': next(trace['ids']), 'name': name, 'parent': parent, 'thread': threading.get_ident(), **info,
+             'start': time.perf_counter()-trace['t0'] }
+    if trace['memory']: span['rss_mb'] = trace_rss_mb()
+    trace['spans'].append(span)
+    span['_token'] = current_trace.set((trace, span['id']))
+    return span
+
+def trace_end(span, **info):
+    if span is None: return
+    trace = current_trace.get()[0]
+    span.update(info)
+    span['duration'] = time.perf_counter()-trace['t0']-span['start']
+    if trace['memory']: span['rss_delta_mb'] = trace_rss_mb()-span['rss_mb']
+    current_trace.reset(span.pop('_token'))
+
+@contextlib.contextmanager
+def trace_span(name, **info):
+    span = trace_start(name, **info)
+    try: yield span if span is not None else {} # So callers can always add info to it
+    finally: trace_end(span)
+
+# Decorator that records a span for each call of the function
+def traced(name=None):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_trace.get() is None: return fn(*args, **kwargs)
+            with trace_span(name or fn.__name__): return fn(*args, **kwargs)
+        return wrapper
+    return decorator
 
-    # Generate new draws
-    new_rows = data.iloc[np.random.choice(len(data),len(new_draws)),:].copy()
-    new_rows['draw'] = new_draws
-    
-    return pd.concat([data, new_rows])
+# Collect a lazy frame, recording its plan (and with profile, the timings of the plan nodes) and the number of rows
+def trace_collect(lf, name='collect', **kwargs):
+    state = current_trace.get()
+    if state is None: return lf.collect(**kwargs)
+    trace = state[0]
+    with trace_span(name) as span:
+        if trace['explain']: span['plan'] = lf.explain(**kwargs)
+        if trace['profile']:
+            df, prof = lf.profile(**kwargs)
+            span['profile'] = prof.to_dicts()
+        else: df = lf.collect(**kwargs)
+        span['rows'] = df.height
+    return df
+
+# Convert a trace to Chrome trace format (viewable in chrome://tracing or Perfetto), optionally writing it to a file
+# Plan nodes timed with profile=True are shown nested under their collect
+def trace_to_chrome(trace, file_name=None):
+    pid, events = os.getpid(), []
+    for span in trace['spans']:
+        if 'duration' not in span: continue # Interrupted by an exception
+        args = { k: v for k,v in span.items() if k not in ['id','name','parent','thread','start','duration','profile'] }
+        events.append({ 'name': span['name'], 'ph': 'X', 'pid': pid, 'tid': span['thread'],
+                        'ts': 1e6*span['start'], 'dur': 1e6*span['duration'], 'args': args })
+        for node in span.get('profile',[]):
+            events.append({ 'name': node['node'], 'ph': 'X', 'pid': pid, 'tid': span['thread'],
+                            'ts': 1e6*span['start']+node['start'], 'dur': node['end']-node['start'] })
+    res = { 'traceEvents': events, 'displayTimeUnit': 'ms' }
+    if file_name is not None:
+        with open(file_name, 'w') as f: json.dump(res, f, default=str)
+    return res
 
 # %% ../nbs/02_pp.ipynb 7
+# Augment each draw with bootstrap data from across whole population to make sure there are at least <threshold> samples
+# Deficits are computed for each (factors, draw) at once and all new rows are resampled in one go with a seeded generator
+# Works on polars (lazy) frames, pandas frames are converted
+def augment_draws(data, factors=None, n_draws=None, threshold=50, seed=0):
+    if isinstance(data, pd.DataFrame): 
+        return augment_draws(pl.from_pandas(data), factors, n_draws, threshold, seed).to_pandas()
+    
+    keys = (factors or []) + ['__aug_group'] # Dummy key so the no factor case needs no special handling
+    ldf = data.lazy().with_columns(pl.lit(0).alias('__aug_group'))
+    counts = ldf.group_by(keys+['draw']).agg(pl.len().alias('__n')).collect()
+    if n_draws is None: n_draws = counts['draw'].max()+1
+
+    # Number of rows missing for each (factors, draw), including draws missing completely
+    all_draws = pl.DataFrame({ 'draw': range(n_draws) }, schema={ 'draw': counts.schema['draw'] })
+    deficits = (counts.select(keys).unique().join(all_draws, how='cross')
+                .join(counts, on=keys+['draw'], how='left', join_nulls=True)
+                .with_columns((threshold - pl.col('__n').fill_null(0).cast(pl.Int64)).alias('__n'))
+                .filter(pl.col('__n')>0)
+                .sort(keys+['draw'], nulls_last=True))
+    if len(deficits)==0: return data # This takes care of large datasets fast
+
+    # Rows of the factor groups that need augmenting, numbered within each group
+    rows = (ldf.with_row_index('__row')
+            .join(deficits.select(keys).unique().lazy(), on=keys, how='semi', join_nulls=True)
+            .sort('__row').with_columns(pl.int_range(pl.len()).over(keys).alias('__i'))
+            .collect())
+    sizes = rows.group_by(keys).agg(pl.len().alias('__size'))
+    deficits = deficits.join(sizes, on=keys, how='left', join_nulls=True)
+
+    # Draw a random row from the same group for each missing row
+    new = deficits[np.repeat(np.arange(len(deficits)), deficits['__n'].to_numpy())]
+    rng = np.random.default_rng(seed)
+    new = new.with_columns(pl.Series('__i', (rng.random(len(new))*new['__size'].to_numpy()).astype(np.int64)))
+    new = new.select(keys+['draw','__i']).join(rows.drop('draw'), on=keys+['__i'], how='left', join_nulls=True)
+
+    cols = data.collect_schema().names()
+    res = pl.concat([ ldf.select(cols), new.lazy().select(cols) ])
+    return res if isinstance(data, pl.LazyFrame) else res.collect()
+
+# %% ../nbs/02_pp.ipynb 9
 # Get the numerical values to map categories to
 def get_cat_num_vals(res_meta,pp_desc):
     try: # First try to convert categories themselves to numbers. Because they might be in some use cases ;) 
@@ -62,14 +173,21 @@ def get_cat_num_vals(res_meta,pp_desc):
     if 'num_values' in pp_desc: nvals = pp_desc['num_values'] 
     return nvals
 
-# %% ../nbs/02_pp.ipynb 9
+# %% ../nbs/02_pp.ipynb 11
 special_columns = ['id', 'weight', 'draw', 'training_subsample', 'original_inds', '__index_level_0__', 'group_size']
 
-# %% ../nbs/02_pp.ipynb 10
+# Statistics columns added by pp for plots with data_format='summary' (see summarize_draws)
+summary_stats = ['min', 'q1', 'median', 'q3', 'max', 'tmin', 'tmax', 'hdi', 'lo', 'hi']
+
+# %% ../nbs/02_pp.ipynb 12
 registry = {}
 registry_meta = {}
 
-# %% ../nbs/02_pp.ipynb 12
+# Caches for plot matching - both are reset whenever the registry changes
+registry_buckets = {}
+capability_cache = {}
+
+# %% ../nbs/02_pp.ipynb 14
 stk_plot_defaults = { 'data_format': 'longform' }
 
 # Decorator for registering a plot type with metadata
@@ -84,6 +202,7 @@ def stk_plot(plot_name, **r_kwargs):
         # Register the function
         registry[plot_name] = gfunc
         registry_meta[plot_name] = { 'name': plot_name, **stk_plot_defaults, **r_kwargs }
+        reset_plot_matching()
         
         return gfunc
     
@@ -92,6 +211,11 @@ def stk_plot(plot_name, **r_kwargs):
 def stk_deregister(plot_name):
     del registry[plot_name]
     del registry_meta[plot_name]
+    reset_plot_matching()
+
+def reset_plot_matching():
+    registry_buckets.clear()
+    for ci in capability_cache.values(): ci['matches'].clear()
 
 def get_plot_fn(plot_name):
     return registry[plot_name]
@@ -102,7 +226,7 @@ def get_plot_meta(plot_name):
 def get_all_plots():
     return sorted(list(registry.keys()))
 
-# %% ../nbs/02_pp.ipynb 13
+# %% ../nbs/02_pp.ipynb 16
 # First is weight if not matching, second if match
 # This is very much a placeholder right now
 n_a = -1000000
@@ -151,48 +275,87 @@ def calculate_priority(plot_meta, match):
     return priority, reasons
 
 
+# Registry metadata bucketed by what decides plot applicability before the facets are looked at:
+# whether raw data is needed, the minimum number of facets, and if question facets are counted
+def get_registry_buckets():
+    if not registry_buckets:
+        for pn, pm in registry_meta.items():
+            key = (pm.get('data_format')=='raw', pm.get('n_facets',(0,0))[0], bool(pm.get('no_question_facet')))
+            registry_buckets.setdefault(key,[]).append((pn,pm))
+    return registry_buckets
+
+# Capability index of a dataset: column metadata, present columns and (lazily filled) non-negativity of columns
+# If a fingerprint (see file_fingerprint) is given, it is cached under it along with the plot matches computed from it
+# NB! The fingerprint should identify both the data and the meta
+capability_cache_size = 32
+def capability_index(df, data_meta, fingerprint=None):
+    if fingerprint is not None and fingerprint in capability_cache: return capability_cache[fingerprint]
+
+    df_cols = df.collect_schema().names() if isinstance(df,pl.LazyFrame) else list(df.columns)
+    ci = { 'col_meta': extract_column_meta(data_meta), 'columns': set(df_cols), 
+           'draws': ('draw' in df_cols), 'mins': {}, 'matches': {} }
+    
+    if fingerprint is not None:
+        if len(capability_cache)>=capability_cache_size: del capability_cache[next(iter(capability_cache))]
+        capability_cache[fingerprint] = ci
+    return ci
+
+# Minimum over a set of columns, using (and filling) the values cached in capability index
+def columns_min(ci, df, cols):
+    missing = [ c for c in cols if c not in ci['mins'] ]
+    if missing:
+        if isinstance(df,pl.LazyFrame): ci['mins'].update(df.select(pl.col(missing).min()).collect().row(0,named=True))
+        else: ci['mins'].update(df[missing].min().to_dict())
+    return min(ci['mins'][c] for c in cols)
+
 # Get a list of plot types matching required spec
-def matching_plots(pp_desc, df, data_meta, details=False, list_hidden=False):
-    col_meta = extract_column_meta(data_meta)
+def matching_plots(pp_desc, df, data_meta, details=False, list_hidden=False, fingerprint=None):
+    ci = capability_index(df, data_meta, fingerprint)
+    col_meta = ci['col_meta']
     
     rc = pp_desc['res_col']
     rcm = col_meta[rc]
 
-    lazy = isinstance(df,pl.LazyFrame)
-    if lazy: df_cols = df.collect_schema().names()
-    else: df_cols = df.columns
-
     # Determine if values are non-negative
     ocols = rcm['columns'] if 'columns' in rcm else [rc]
-    cols = [ c for c in ocols if c in df_cols ]
+    cols = [ c for c in ocols if c in ci['columns'] ]
     if not cols: raise ValueError(f"Columns {ocols} not found in data")
 
-    nonneg = ('categories' in rcm) or (
-        df[cols].min(axis=None)>=0 if not lazy else 
-        df.select(pl.min_horizontal(pl.col(cols).min())).collect().item()>=0)
-
-    if pp_desc.get('convert_res')=='continuous' and ('categories' in rcm):
-        nonneg = min([ v for v in get_cat_num_vals(rcm,pp_desc) if v is not None ])>=0
-
-    match = {
-        'draws': ('draw' in df_cols),
-        'nonnegative': nonneg,
-        'hidden': list_hidden,
-
-        'res_col': rc,
-        'categorical': ('categories' in rcm) and pp_desc.get('convert_res')!='continuous',
-        'facet_metas': [ {'name':cn, **col_meta[cn]} for cn in pp_desc['factor_cols']]
-    }
-    
-    res = [ ( pn, *calculate_priority(get_plot_meta(pn),match)) for pn in registry.keys() ]
+    key = (rc, tuple(pp_desc['factor_cols']), pp_desc.get('convert_res'), tuple(pp_desc.get('num_values') or []), list_hidden)
+    if key not in ci['matches']:
+        nonneg = ('categories' in rcm) or columns_min(ci, df, cols)>=0
+
+        if pp_desc.get('convert_res')=='continuous' and ('categories' in rcm):
+            nonneg = min([ v for v in get_cat_num_vals(rcm,pp_desc) if v is not None ])>=0
+
+        match = {
+            'draws': ci['draws'],
+            'nonnegative': nonneg,
+            'hidden': list_hidden,
+
+            'res_col': rc,
+            'categorical': ('categories' in rcm) and pp_desc.get('convert_res')!='continuous',
+            'facet_metas': [ {'name':cn, **col_meta[cn]} for cn in pp_desc['factor_cols']]
+        }
+        n_facets = len(match['facet_metas'])
+        n_nq_facets = len([ f for f in match['facet_metas'] if f['name'] not in ['question',rc]])
+
+        # Whole buckets can be ruled out without looking at individual plots
+        res = {}
+        for (raw, min_facets, no_question), plots in get_registry_buckets().items():
+            if match['categorical'] and raw: res.update({ pn: (n_a, ['raw_data']) for pn, _ in plots })
+            elif (n_nq_facets if no_question else n_facets) < min_facets: res.update({ pn: (n_a, ['n_facets']) for pn, _ in plots })
+            else: res.update({ pn: calculate_priority(pm,match) for pn, pm in plots })
+        ci['matches'][key] = [ (pn, *res[pn]) for pn in registry.keys() ]
+    res = ci['matches'][key]
     
     if details: return { n: (p, i) for (n, p, i) in res } # Return dict with priorities and failure reasons
     else: return [ n for (n,p,i) in sorted(res,key=lambda t: t[1], reverse=True) if p >= 0 ] # Return list of possibilities in decreasing order of fit
 
-# %% ../nbs/02_pp.ipynb 18
+# %% ../nbs/02_pp.ipynb 22
 cont_transform_options = ['center','zscore','proportion','softmax','softmax-ratio']
 
-# %% ../nbs/02_pp.ipynb 19
+# %% ../nbs/02_pp.ipynb 23
 # Polars is annoyingly verbose for these but it is fast enough to be worth it
 def transform_cont(data, cols, transform, val_format='.1f', val_range=None):
     if not transform: return data, val_format, val_range
@@ -207,7 +370,7 @@ def transform_cont(data, cols, transform, val_format='.1f', val_range=None):
         return data.with_columns(pl.col(cols).exp()*mult / pl.sum_horizontal(pl.col(cols).exp())), val_format, (0.0,1.0*mult)
     else: raise Exception(f"Unknown transform '{transform}'")
 
-# %% ../nbs/02_pp.ipynb 20
+# %% ../nbs/02_pp.ipynb 24
 # Get categories from a lazy frame. 
 def ensure_ldf_categories(col_meta, col, ldf):
     cats = col_meta[col]['categories']
@@ -224,13 +387,12 @@ def get_cats(col, cats=None):
     return [ c for c in cats if c in uvals ]
 
 
-# %% ../nbs/02_pp.ipynb 21
-def pp_filter_data_lz(df, filter_dict, c_meta):
-
-    colnames = df.collect_schema().names()
-
-    inds = True
-
+# %% ../nbs/02_pp.ipynb 25
+# Compile a filter dict into a list of conditions, resolving group names and category ranges against the meta
+# Each condition is either (col, 'range', (start, end)) for continuous ranges or (col, 'in', values) 
+# col_cats(col) is used to get the categories for ordered ranges if they are not given in the meta
+def compile_filter(filter_dict, c_meta, col_cats):
+    conds = []
     for k, v in filter_dict.items():
         
         # Range filters have form [None,start,end]
@@ -238,13 +400,13 @@ def pp_filter_data_lz(df, filter_dict, c_meta):
 
         # Handle continuous variables separately
         if is_range and (not isinstance(v[1],str) or c_meta[k].get('continuous') or c_meta[k].get('datetime')): # Only special case where we actually need a range
-            if v[1] is not None: inds = (pl.col(k)>=v[1]) & inds
-            if v[2] is not None: inds = (pl.col(k)<=v[2]) & inds
-            continue # NB! this approach does not work for ordered categoricals with polars LazyDataFrame, hence handling that separately below
+            conds.append((k, 'range', (v[1], v[2])))
+            continue
         
         # Handle categoricals
         if is_range: # Range of values over ordered categorical
-            cats = ensure_ldf_categories(c_meta,k,df)['categories']
+            cats = c_meta[k].get('categories')
+            cats = list(cats if isinstance(cats,list) else col_cats(k))
             if set(v[1:]) & set(cats) != set(v[1:]): 
                 warn(f'Column {k} values {v} not found in {cats}, not filtering')
                 flst = cats
@@ -255,22 +417,80 @@ def pp_filter_data_lz(df, filter_dict, c_meta):
         elif 'groups' in c_meta[k] and v in c_meta[k]['groups']:
             flst = c_meta[k]['groups'][v]
         else: flst = [v] # Just filter on single value    
-            
-        inds &=  pl.col(k).is_in(flst) & ~pl.col(k).is_null()
-            
+        conds.append((k, 'in', flst))
+    return conds
+
+# Membership of integer codes as a union of contiguous ranges - this is much faster than is_in on integers
+def codes_in(expr, codes):
+    codes = sorted(set(codes))
+    if not codes: return pl.lit(False)
+    res, start = None, codes[0]
+    for c, nc in zip(codes, codes[1:]+[None]):
+        if nc == c+1: continue
+        cond = (expr==start) if start==c else expr.is_between(start,c)
+        res = cond if res is None else (res | cond)
+        start = nc
+    return res
+
+# Filter a polars LazyFrame
+# Enum columns (f.e. from combine_annotated_data) are filtered on their physical codes, which is an order of magnitude faster than comparing values
+# Categorical columns, as read by read_annotated_data_lazy, are compared by value, as casting them to Enum in the query costs as much as it saves
+# For combined datasets (see combine_annotated_data), missing is meta['missing_columns'] and filters skip the datasets without the column
+def pp_filter_data_lz(df, filter_dict, c_meta, missing=None):
+
+    schema = df.collect_schema()
+    inds = True
+
+    def col_cats(k): # Enum columns already know their categories, so avoid the scan
+        return schema[k].categories.to_list() if isinstance(schema[k],pl.Enum) else ensure_ldf_categories(c_meta,k,df)['categories']
+
+    for k, kind, vals in compile_filter(filter_dict, c_meta, col_cats):
+        if kind == 'range':
+            cond = True
+            if vals[0] is not None: cond = (pl.col(k)>=vals[0]) & cond
+            if vals[1] is not None: cond = (pl.col(k)<=vals[1]) & cond
+            if cond is True: continue
+        elif isinstance(schema[k],pl.Enum):
+            cats = { c: i for i, c in enumerate(schema[k].categories.to_list()) }
+            cond = codes_in(pl.col(k).to_physical(), [ cats[v] for v in vals if v in cats ])
+        else:
+            cond = pl.col(k).is_in(vals) & ~pl.col(k).is_null()
+
+        if missing and missing['columns'].get(k): cond = cond | pl.col(missing['key']).is_in(missing['columns'][k])
+        inds = cond & inds
+
     filtered_df = df.filter(inds)
     
     return filtered_df
 
-# This is a wrapper that allows the filter to work on pandas DataFrames
+# Filter a pandas DataFrame. Categoricals are filtered with boolean masks on their codes
 def pp_filter_data(df, filter_dict, c_meta):
-    return pp_filter_data_lz(pl.DataFrame(df).lazy(), filter_dict, c_meta).collect().to_pandas()
 
+    def col_cats(k): # Same as ensure_ldf_categories but for pandas
+        if isinstance(df[k].dtype,pd.CategoricalDtype) and df[k].dtype.ordered: return list(df[k].dtype.categories)
+        return list(np.sort(df[k].dropna().unique()))
+
+    mask = np.ones(len(df),dtype=bool)
+    for k, kind, vals in compile_filter(filter_dict, c_meta, col_cats):
+        col = df[k]
+        if kind == 'range':
+            if vals[0] is not None: mask &= (col>=vals[0]).to_numpy()
+            if vals[1] is not None: mask &= (col<=vals[1]).to_numpy()
+        elif isinstance(col.dtype,pd.CategoricalDtype):
+            allowed = np.zeros(len(col.cat.categories)+1,dtype=bool) # Last one is for missing values (code -1)
+            inds = col.cat.categories.get_indexer(vals)
+            allowed[inds[inds>=0]] = True
+            mask &= allowed[col.cat.codes.to_numpy()]
+        else: mask &= col.isin(vals).to_numpy()
+    return df[mask].reset_index(drop=True)
 
-# %% ../nbs/02_pp.ipynb 22
-# While polars-ized, it is still slow because of the collects. 
-# This can likely be improved by batching all of the required collects into a single select (over all columns)
-# In practice, this is probably not worth it because this is not used very often
+
+# %% ../nbs/02_pp.ipynb 27
+# Size of the sample the quantile sketch is computed from for numeric factors without one (see pp_transform_data)
+fallback_sketch_sample = 10000
+
+# Discretize a numeric column into nicely labelled bins
+# Breaks come from the quantile sketch in col_meta (see add_quantile_sketches), so they are stable and need no data access
 def discretize_continuous(ldf, col, col_meta={}):
     if 'bin_breaks' in col_meta and 'bin_labels' in col_meta:
         breaks, labels = col_meta['bin_breaks'], col_meta['bin_labels']
@@ -278,20 +498,12 @@ def discretize_continuous(ldf, col, col_meta={}):
     else:
         breaks = col_meta.get('bin_breaks',5)
         fmt = col_meta.get('val_format','.1f') 
-        if False: # Precise computation is slow
-            if isinstance(breaks,int): # This requires computing quantiles for each break - slow
-                breaks = list(np.unique([
-                    ldf.select([pl.col(col).quantile(br).alias(str(br))  
-                    for br in np.linspace(0,1,breaks+1) ]).collect().to_pandas().values.T
-                ]))
-            mima = ldf.select([pl.col(col).min().alias('min'),pl.col(col).max().alias('max')]).collect().to_pandas()
-            mi, ma = mima['min'].values[0], mima['max'].values[0]
-        else: # Approximate computation is considerably faster
-            nbreaks = len(breaks) if isinstance(breaks,list) else breaks
-            vals = ldf.select(pl.col(col).sample(200*nbreaks,with_replacement=True)).collect().to_pandas()[col].values
-            if isinstance(breaks,int):
-                breaks = list(np.unique(np.quantile(vals,np.linspace(0,1,breaks+1))))
-            mi, ma = vals.min(), vals.max()
+        sketch = col_meta['quantiles']
+        if not sketch: return ldf.with_columns(pl.col(col).cast(pl.String).cast(pl.Categorical)), [] # No values, so nothing to bin
+        if isinstance(breaks,int): # Interpolate the quantiles for breaks from the sketch
+            breaks = list(np.unique(np.interp(np.linspace(0,1,breaks+1), np.linspace(0,1,len(sketch)), sketch)))
+        else: breaks = list(breaks)
+        mi, ma = sketch[0], sketch[-1]
 
         isint = ldf.collect_schema()[col].is_integer()
         breaks, labels = cut_nice_labels(breaks, mi, ma, isint, fmt)
@@ -299,18 +511,39 @@ def discretize_continuous(ldf, col, col_meta={}):
         
     return ldf, labels
 
-# %% ../nbs/02_pp.ipynb 23
+# %% ../nbs/02_pp.ipynb 28
+# Rough overall sampling error of a subsampled frame, based on the Kish effective sample size
+# For categorical results it is the worst case standard error of a proportion, for continuous ones the standard error of the mean
+def sampling_error(ldf, res_col, weight_col, n_questions=1, fraction=1.0):
+    v, w = pl.col(res_col), pl.col(weight_col)
+    aggs = [ pl.len().alias('n'), w.sum().alias('w'), (w**2).sum().alias('w2') ]
+    continuous = ldf.collect_schema()[res_col].is_numeric()
+    if continuous:
+        wv = pl.when(v.is_not_null()).then(w)
+        aggs += [ wv.sum().alias('wv'), (v*wv).sum().alias('vw'), (v**2*wv).sum().alias('v2w') ]
+    r = ldf.select(aggs).collect().row(0, named=True)
+
+    n_eff = r['w']**2/r['w2']/n_questions if r['w2'] else 0.0
+    if continuous and r['wv']:
+        mean = r['vw']/r['wv']
+        sd = np.sqrt(max(r['v2w']/r['wv'] - mean**2, 0.0))
+    else: sd = 0.5
+    return { 'fraction': fraction, 'n': r['n']//n_questions, 'n_eff': n_eff, 'se': float(sd/np.sqrt(n_eff)) if n_eff>0 else np.inf }
+
+# %% ../nbs/02_pp.ipynb 29
 # Get all data required for a given graph
 # Only return columns and rows that are needed, aggregated to the format plot requires
 # Internally works with polars LazyDataFrame for large data set performance
 
+@traced()
 def pp_transform_data(full_df, data_meta, pp_desc, columns=[]):
     pl.enable_string_cache() # So we can work on categorical columns
 
-    plot_meta = get_plot_meta(pp_desc['plot'])
-    
-    gc_dict = group_columns_dict(data_meta)
-    c_meta = extract_column_meta(data_meta)
+    with trace_span('meta'):
+        plot_meta = get_plot_meta(pp_desc['plot'])
+        gc_dict = group_columns_dict(data_meta)
+        c_meta = extract_column_meta(data_meta)
+    plan_span = trace_start('plan')
 
     # Setup lazy frame if not already:
     if not isinstance(full_df,pl.LazyFrame):
@@ -334,7 +567,8 @@ def pp_transform_data(full_df, data_meta, pp_desc, columns=[]):
     # It will be made one for categorical plots for plotting part, but for pp_transform_data, remove it
     if pp_desc['res_col'] in factor_cols: factor_cols.remove(pp_desc['res_col']) 
     
-    extra_cols = columns + ([ weight_col ] +
+    missing = data_meta.get('missing_columns') # For combined datasets (see combine_annotated_data)
+    extra_cols = columns + ([ weight_col ] + ([ missing['key'] ] if missing else []) +
                     (['training_subsample'] if not pp_desc.get('poststrat',True) else []) +
                     (['draw'] if plot_meta.get('draws') else []))
     cols = [ pp_desc['res_col'] ]  + factor_cols + list(pp_desc.get('filter',{}).keys())
@@ -349,23 +583,32 @@ def pp_transform_data(full_df, data_meta, pp_desc, columns=[]):
         del data_meta['draws_data']
     
     df = full_df.select(cols) # Select only the columns we need
-    total_n = df.select(pl.len()).collect().item()
+    total_n = trace_collect(df.select(pl.len()), 'count').item()
 
     # Add row id-s - needs to happen before filtering
     df = df.with_row_count('id')
     
     # Filter the data with given filters
     if pp_desc.get('filter'):
-        filtered_df = pp_filter_data_lz(df, pp_desc.get('filter',{}), c_meta)
+        filtered_df = pp_filter_data_lz(df, pp_desc.get('filter',{}), c_meta, missing)
     else: filtered_df = df
 
+    # Leave out the datasets that do not have the result column at all, as a plot per dataset would
+    if missing:
+        no_res = set.intersection(*[ set(missing['columns'].get(c,[])) for c in gc_dict.get(pp_desc['res_col'], [pp_desc['res_col']]) ])
+        if no_res: filtered_df = filtered_df.filter(~pl.col(missing['key']).is_in(sorted(no_res)))
+
     # If we want to approximate original data without poststrat, filter to training subsample
     if (not pp_desc.get('poststrat',True)) and 'training_subsample' in cols:
         filtered_df = filtered_df.filter(pl.col('training_subsample'))
 
-    # Sample from filtered data
-    if 'sample' in pp_desc: filtered_df = filtered_df.sample(n=pp_desc['sample'], with_replacement=True)
-    
+    # Deterministic subsample for quick approximate results. pp_desc['sample'] is a number of rows of the full data,
+    # and the fraction it is of all rows (sample/total rows) is kept, also of filtered data (so a filter leaves fewer than sample rows)
+    # Rows are picked by a hash of their id, so smaller samples are always subsets of larger ones
+    sample_frac = min(1.0, pp_desc['sample']/max(total_n,1)) if pp_desc.get('sample') else 1.0
+    if sample_frac<1.0:
+        filtered_df = filtered_df.filter(pl.col('id').hash(pp_desc.get('sample_seed',0)) < int(sample_frac*(2**64-1)))
+
     # Convert ordered categorical to continuous if we can
     rcl = gc_dict.get(pp_desc['res_col'], [pp_desc['res_col']])
     for rc in rcl:
@@ -392,8 +635,13 @@ def pp_transform_data(full_df, data_meta, pp_desc, columns=[]):
 
     # Discretize factor columns that are numeric
     for c in factor_cols:
-        if c in cols and schema[c].is_numeric():    
-            raw_df, labels = discretize_continuous(raw_df,c,c_meta.get(c,{}))
+        if c in cols and schema[c].is_numeric():
+            if 'quantiles' not in c_meta[c] and not ('bin_breaks' in c_meta[c] and 'bin_labels' in c_meta[c]):
+                # Files processed before sketches were added have none, so it is computed from a bounded sample of the full data,
+                # so breaks do not depend on the filter and each plot does not sort the whole column
+                # It is only kept in c_meta, as data_meta can be shared with other threads. Columns without values get an empty sketch
+                c_meta[c]['quantiles'] = quantile_sketches(full_df, [c], sample=fallback_sketch_sample).get(c, [])
+            filtered_df, labels = discretize_continuous(filtered_df,c,c_meta[c])
             # Make sure it gets restored to pandas properly
             c_meta[c].update({ 'categories': labels, 'ordered': True, 'continuous': False })
 
@@ -406,39 +654,54 @@ def pp_transform_data(full_df, data_meta, pp_desc, columns=[]):
         draw_df = pl.DataFrame({ 'draw': draws, 'id': np.arange(0, total_n) })
         filtered_df = filtered_df.drop('draw').join(draw_df.lazy(), on=['id'], how='left')
 
-    # If res_col is a group of questions, melt i.e. unpivot the questions and handle draws if needed
+    # If res_col is a group of questions, either aggregate each question column separately (default)
+    # or melt i.e. unpivot the questions into one long table first (needed for raw data or if asked for)
     if pp_desc['res_col'] in gc_dict:
         n_questions = len(gc_dict[pp_desc['res_col']])
-
-        # Melt i.e. unpivot the questions
         value_vars = [ c for c in gc_dict[pp_desc['res_col']] if c in cols ]
         id_vars = ['id'] + [ c for c in cols if (c not in value_vars or c in factor_cols) ]
-        filtered_df = filtered_df.unpivot(
-            variable_name='question',
-            value_name=pp_desc['res_col'],
-            index=id_vars,
-            on=value_vars,
-        )
-
-        # Handle draws for each question
+
+        # Draws computed separately for each question
+        q_draws = {}
         if 'draw' in cols and data_meta.get('draws_data') is not None:
-            draw_dfs = []
             for c in value_vars:
                 if c in data_meta.get('draws_data',{}):
                     uid, ndraws = data_meta['draws_data'][c]
-                    draws = stable_draws(total_n, ndraws, uid)
-                    draw_df = pl.DataFrame({ 'draw': draws, 'question': c, 'id': np.arange(0, total_n) })
-                    draw_dfs.append(draw_df)
-            
-            if len(draw_dfs)>0:
+                    q_draws[c] = pl.DataFrame({ 'draw': stable_draws(total_n, ndraws, uid), 'id': np.arange(0, total_n) })
+
+        strategy = pp_desc.get('question_strategy', 'columns' if plot_meta.get('data_format')!='raw' and 'question' in factor_cols else 'unpivot')
+        if strategy == 'columns':
+            # One frame per question, each with the same dtype unpivot would have produced
+            res_dtype = filtered_df.select(value_vars).unpivot().collect_schema()['value']
+            q_dfs = []
+            for c in value_vars:
+                q_df = filtered_df.select(*id_vars, pl.col(c).cast(res_dtype).alias(pp_desc['res_col']),
+                                          pl.lit(c).cast(pl.Enum(value_vars)).alias('question'))
+                if c in q_draws:
+                    q_df = (q_df.rename({'draw':'old_draw'}).join(q_draws[c].lazy(), on=['id'], how='left')
+                            .with_columns(pl.col('draw').fill_null(pl.col('old_draw'))).drop('old_draw'))
+                q_dfs.append(q_df)
+            filtered_df = q_dfs
+        elif strategy == 'unpivot':
+            filtered_df = filtered_df.unpivot(
+                variable_name='question',
+                value_name=pp_desc['res_col'],
+                index=id_vars,
+                on=value_vars,
+            )
+
+            # Handle draws for each question
+            if q_draws:
+                draw_df = pl.concat([ df.with_columns(pl.lit(c).alias('question')) for c, df in q_draws.items() ])
                 filtered_df = filtered_df.rename({'draw':'old_draw'}).join(
-                    pl.concat(draw_dfs).lazy(),
+                    draw_df.lazy(),
                     on=['id', 'question'],
                     how='left'
                 ).with_columns(pl.col('draw').fill_null(pl.col('old_draw'))).drop('old_draw')
-            
-        # Convert question to categorical with correct order
-        filtered_df = filtered_df.with_columns(pl.col('question').cast(pl.Enum(value_vars)))
+
+            # Convert question to categorical with correct order
+            filtered_df = filtered_df.with_columns(pl.col('question').cast(pl.Enum(value_vars)))
+        else: raise ValueError(f"Unknown question_strategy: {strategy}")
     else:
         n_questions = 1
         if 'question' in factor_cols:
@@ -446,29 +709,253 @@ def pp_transform_data(full_df, data_meta, pp_desc, columns=[]):
                 pl.lit(pp_desc['res_col']).alias('question').cast(pl.Categorical)
             )
         
+    trace_end(plan_span)
+
     # Aggregate the data into right shape
     pparams = wrangle_data(filtered_df, c_meta, factor_cols, weight_col, pp_desc, n_questions)
 
     pparams['val_format'] = val_format
-    pparams['val_range'] = val_range # Currently not used 
-    
+    pparams['val_range'] = val_range # Currently not used
+
+    # Flag subsampled results and give a rough overall scale of the sampling error
+    if sample_frac<1.0:
+        pparams['approximate'] = True
+        s_df = pl.concat(filtered_df, how='diagonal_relaxed') if isinstance(filtered_df,list) else filtered_df
+        pparams['sampling_error'] = sampling_error(s_df, pp_desc['res_col'], weight_col, n_questions, fraction=sample_frac)
+
     # Remove prefix from question names in plots
     if 'col_prefix' in c_meta[pp_desc['res_col']] and 'question' in pparams['data'].columns:
-        prefix = c_meta[pp_desc['res_col']]['col_prefix']
-        cmap = { c: c.replace(prefix,'') for c in pparams['data']['question'].dtype.categories }
-        pparams['data']['question'] = pparams['data']['question'].cat.rename_categories(cmap)
+        prefix, q = c_meta[pp_desc['res_col']]['col_prefix'], pparams['data']['question']
+        cats = column_categories(q) or q.cast(pl.String).drop_nulls().unique(maintain_order=True).to_list()
+        cmap = { c: c.replace(prefix,'') for c in cats }
+        if isinstance(q,pl.Series): pparams['data'] = pparams['data'].with_columns(q.cast(pl.String).replace(cmap).cast(pl.Enum(list(cmap.values()))))
+        else: pparams['data']['question'] = q.cat.rename_categories(cmap)
 
     return pparams
 
-# %% ../nbs/02_pp.ipynb 25
+# %% ../nbs/02_pp.ipynb 30
+# Progressive version of pp_transform_data: yields quick approximate pparams computed on nested subsamples
+# of increasing size (see 'sample' above), followed by the full precision result.
+# Steps that would cover a large fraction of data anyway are skipped as they would not be much faster
+def pp_transform_data_progressive(full_df, data_meta, pp_desc, steps=(20000, 200000), max_frac=0.5, **kwargs):
+    if not isinstance(full_df,pl.LazyFrame): full_df = pl.DataFrame(full_df).lazy()
+    total_n = full_df.select(pl.len()).collect().item()
+    max_n = min(total_n*max_frac, pp_desc.get('sample') or np.inf)
+    for n in steps:
+        if n < max_n: yield pp_transform_data(full_df, data_meta, {**pp_desc, 'sample': n}, **kwargs)
+    yield pp_transform_data(full_df, data_meta, pp_desc, **kwargs)
+
+# %% ../nbs/02_pp.ipynb 32
+# Weighted quantile of res_col within a group_by: the value at which cumulative weight (in sorted order) reaches q of the total
+# If it is reached exactly, the next value is averaged in, so with equal weights this matches the usual median
+def weighted_quantile(res_col, weight_col, q):
+    valid = pl.col(res_col).is_not_null() & pl.col(weight_col).is_not_null()
+    vals = pl.col(res_col).filter(valid)
+    cw = pl.col(weight_col).filter(valid).sort_by(vals).cum_sum()
+    vals, target = vals.sort(), q*cw.last()
+    lower = pl.coalesce(vals.filter(cw>=target).first(), vals.last())
+    upper = pl.coalesce(vals.filter(cw>target).first(), lower)
+    return (lower+upper)/2
+
+# Expression for weighted quantile based agg_fn-s: 'median', 'iqr' (interquartile range) and 'q<percentile>' f.e. 'q10' or 'q2.5'
+# Returns None for other agg_fn-s
+def weighted_quantile_agg(agg_fn, res_col, weight_col):
+    if agg_fn == 'median': return weighted_quantile(res_col, weight_col, 0.5)
+    elif agg_fn == 'iqr': return weighted_quantile(res_col, weight_col, 0.75) - weighted_quantile(res_col, weight_col, 0.25)
+    elif agg_fn[:1] == 'q':
+        try: q = float(agg_fn[1:])/100
+        except ValueError: return None
+        if not 0<=q<=1: raise ValueError(f"Quantile out of range in agg_fn: {agg_fn}")
+        return weighted_quantile(res_col, weight_col, q)
+    return None
+
+# Aggregate a (lazy) frame to longform - one value per group of gb_dims (and category of res_col if categorical)
+def aggregate_longform(raw_df, gb_dims, res_col, weight_col, agg_fn, is_categorical):
+    if is_categorical:
+        # Aggregate the data
+        data = (raw_df
+                .group_by(gb_dims + [res_col])
+                .agg(pl.col(weight_col).sum().alias('percent')))
+
+        # Add weight_col to the data
+        totals = raw_df.group_by(gb_dims).agg(pl.col(weight_col).sum())
+        data = data.join(totals, on=gb_dims)
+            
+        if agg_fn == 'mean':
+            data = data.with_columns( pl.col('percent') / pl.col(weight_col) )
+        elif agg_fn != 'sum':
+            raise Exception(f"Unknown agg_fn: {agg_fn}")
+
+    else: # Continuous
+        
+        if agg_fn in ['mean','sum']: # Use weighted sum to compute both sum and mean
+            data = (raw_df
+                    .with_columns((pl.col(res_col)*pl.col(weight_col)).alias(res_col))
+                    .group_by(gb_dims)
+                    .agg(pl.col([res_col,weight_col]).sum()))
+            if agg_fn == 'mean':
+                data = data.with_columns(pl.col(res_col)/pl.col(weight_col).alias(res_col))
+        elif (wq := weighted_quantile_agg(agg_fn, res_col, weight_col)) is not None: # median, quantiles, iqr
+            data = (raw_df
+                    .group_by(gb_dims)
+                    .agg([wq.alias(res_col), pl.col(weight_col).sum()]))
+        else:  # min, max, etc. - ignore weight_col
+            data = (raw_df
+                    .group_by(gb_dims)
+                    .agg([getattr(pl.col(res_col), agg_fn)().alias(res_col), pl.col(weight_col).sum()]))
+    return data
+
+# Replace categorical columns with their physical codes (as UInt32) using category lists from the dtype or meta
+# Values missing from the category list raise an error when the frames are collected, rather than silently becoming null
+# Returns the encoded frames and the category lists for decoding
+def encode_categoricals(raw_dfs, cols, col_meta):
+    schema, cats = raw_dfs[0].collect_schema(), {}
+    for c in cols:
+        if isinstance(schema[c], pl.Enum): cats[c] = list(schema[c].categories)
+        elif isinstance(schema[c], (pl.Categorical, pl.String)):
+            m_cats = col_meta.get(c,{}).get('categories')
+            if isinstance(m_cats,list): cats[c] = [ str(v) for v in m_cats ]
+            else: # Categories not known in advance, so look them up
+                cats[c] = sorted(pl.concat([ df.select(pl.col(c).cast(pl.String).unique()) for df in raw_dfs ])
+                                 .unique().collect(streaming=True)[c].drop_nulls().to_list())
+    codes = [ pl.col(c).cast(pl.String).cast(pl.Enum(cs)).to_physical() for c, cs in cats.items() ]
+    return [ df.with_columns(codes) for df in raw_dfs ], cats
+
+# Map category codes back to labels in the (small) aggregated pandas result
+def decode_categoricals(data, cats):
+    for c, cs in cats.items():
+        data[c] = pd.Categorical.from_codes(data[c].fillna(-1).astype(int), cs)
+    return data
+
+# Same for polars data (see native in pp_desc), giving Enum columns
+def decode_categoricals_pl(data, cats):
+    return data.with_columns([ pl.col(c).replace_strict(list(range(len(cs))), cs, default=None, return_dtype=pl.Enum(cs)) for c, cs in cats.items() ])
+
+# Categories of a pandas or polars column
+def column_categories(col):
+    if isinstance(col, pl.Series): return col.dtype.categories.to_list() if isinstance(col.dtype, pl.Enum) else None
+    return list(col.dtype.categories) if col.dtype.name=='category' else None
+
+# Polars version of fixing the categories of plot data (see wrangle_data), casting category columns to Enums of the used categories
+def fix_categories_pl(data, col_meta, res_col, skip=[]):
+    casts = []
+    for c in data.columns:
+        if c in skip or not col_meta.get(c,{}).get('categories'): continue
+        m_cats = col_meta[c]['categories'] if col_meta[c]['categories']!='infer' else None
+        vals = data[c].cast(pl.String).drop_nulls().unique(maintain_order=True).to_list()
+        if m_cats is not None and c==res_col and col_meta[c].get('likert'): f_cats = m_cats # Do not trim likert as plots need to be symmetric
+        else:
+            cats = m_cats if m_cats is not None and set(vals)<=set(m_cats) else (column_categories(data[c]) or vals)
+            f_cats = [ c for c in cats if c in set(vals) ]
+        casts.append(pl.col(c).cast(pl.String).cast(pl.Enum(f_cats)))
+    return data.with_columns(casts)
+
+# Convert polars plot data to pandas, with Enum columns becoming categoricals (ordered as in col_meta)
+def plot_data_to_pandas(data, col_meta):
+    df = data.to_pandas()
+    for c in df.columns:
+        if df[c].dtype.name=='category' and col_meta.get(c,{}).get('ordered'): df[c] = df[c].cat.as_ordered()
+    return df
+
+# Summarize draws of value_col within groups of gb_dims to summary_stats, replacing value_col itself with the mean
+# Quantiles are interpolated linearly and tmin/tmax are Tukey whiskers, as in boxplot_vals
+# HDIs are the narrowest intervals over the sorted draws, as in arviz. Each level in hdis gets its own row
+def summarize_draws(data, gb_dims, value_col, hdis=[], extent=1.5):
+    if not gb_dims: data, gb_dims = data.with_columns(pl.lit('dummy').alias('__dummy')), ['__dummy']
+    v = pl.col(value_col)
+    q1, q3 = v.quantile(0.25,'linear'), v.quantile(0.75,'linear')
+    stats = [ v.min().alias('min'), q1.alias('q1'), v.median().alias('median'), q3.alias('q3'), v.max().alias('max'),
+              v.filter(v > q1-extent*(q3-q1)).min().alias('tmin'), v.filter(v < q3+extent*(q3-q1)).max().alias('tmax'),
+              v.mean() ]
+    if 'group_size' in data.collect_schema().names(): stats.append(pl.col('group_size').mean())
+
+    # Width of interval starting at each sorted value is found by looking k rows ahead
+    if hdis: data = data.filter(v.is_not_null()).sort(gb_dims+[value_col])
+    for i, p in enumerate(hdis):
+        k = (pl.len().over(gb_dims)*p).floor().cast(pl.Int64)
+        data = data.with_columns(v.gather((pl.int_range(pl.len())+k).clip(upper_bound=pl.len()-1)).alias(f'__hi{i}'))
+        data = data.with_columns(pl.when(pl.int_range(pl.len()).over(gb_dims) < pl.len().over(gb_dims)-k)
+                                   .then(pl.col(f'__hi{i}')-v).alias(f'__w{i}'))
+        stats += [ c.sort_by(f'__w{i}',nulls_last=True,maintain_order=True).first().alias(f'__{n}{i}') for n, c in [('lo',v),('hi',pl.col(f'__hi{i}'))] ]
+    
+    res = data.group_by(gb_dims).agg(stats)
+    if hdis:
+        res = pl.concat([ res.with_columns(pl.col(f'__lo{i}').alias('lo'), pl.col(f'__hi{i}').alias('hi'), pl.lit(p).alias('hdi'))
+                          for i, p in enumerate(hdis) ])
+    return res.drop(pl.selectors.starts_with('__'))
+
+# Weighted sample of at most n rows from each stratum, done within the polars plan
+# Uses weighted reservoir sampling (Efraimidis-Spirakis) with keys log(u)/weight, where u is a seeded hash of the row id,
+# so the sample is deterministic and rows with larger weights are more likely to be kept. Strata smaller than n are kept whole
+def stratified_sample(ldf, strata, n, weight_col=None, seed=0):
+    u = (pl.col('id').hash(seed).cast(pl.Float64)+1.0)/(2.0**64+2.0)
+    key = u.log()/pl.col(weight_col) if weight_col else u
+    rank = key.rank('ordinal', descending=True)
+    return ldf.filter((rank.over(strata) if strata else rank) <= n)
+
+# Memory budget (in MB) for the data of a single plot, which can be overridden with pp_desc['memory_budget_mb']
+plot_memory_budget_mb = 2048
+min_guard_draws = 20 # Draws are not thinned below this many
+
+# Estimate the size of the data wrangle_data collects, before collecting it
+# Rows of aggregated data are bounded both by the input rows and the product of category counts of the dimensions
+# Counts come from the schema or meta where possible. Others, along with the number of rows and total weight, are found in one pass
+def estimate_plot_size(raw_dfs, gb_dims, res_col, weight_col, col_meta, data_format, is_categorical, n_hdis=1, sample=None):
+    schema = raw_dfs[0].collect_schema()
+    def known_count(c):
+        if c=='dummy_col': return 1
+        if isinstance(schema[c], pl.Enum): return len(schema[c].categories)
+        cats = col_meta.get(c,{}).get('categories')
+        return len(cats) if isinstance(cats, list) else None
+
+    dims = [ d for d in gb_dims if d!='id' ] + ([res_col] if is_categorical and data_format!='raw' else [])
+    unknown = [ c for c in dims if known_count(c) is None ]
+    stats = trace_collect(raw_dfs[0].select(pl.len().alias('__rows'), pl.col(weight_col).sum().alias('__weight'),
+                                            *[ pl.col(c).n_unique() for c in unknown ]), 'size_estimate', streaming=True).row(0, named=True)
+    counts = { c: stats[c] if c in unknown else known_count(c) for c in dims }
+    product = lambda cs: float(np.prod([ counts[c] for c in cs ], dtype=float))
+
+    in_rows = stats['__rows']*len(raw_dfs)
+    if data_format=='raw': rows, n_cols = (min(in_rows, product(dims)*sample) if sample else in_rows), len(gb_dims)+1
+    elif data_format=='summary': rows, n_cols = min(in_rows, product([ d for d in dims if d!='draw' ])*max(n_hdis,1)), len(dims)+len(summary_stats)
+    else: rows, n_cols = min(in_rows, product(dims)), len(dims)+2
+    return { 'input_rows': in_rows, 'input_mb': in_rows*len(schema)*8/1024**2, 'rows': int(rows), 'mb': rows*n_cols*8/1024**2,
+             'draws': counts.get('draw'), 'weight': stats['__weight'] }
+
+# Decide how to keep the plot data within budget: the streaming engine for large inputs, and for large results
+# thinning the draws or sampling rows (for raw data) - or refusing if neither helps. The decision is recorded in pparams
+def memory_guard(est, budget_mb, data_format, streaming=False):
+    guard = { 'budget_mb': budget_mb, 'estimated_rows': est['rows'], 'estimated_mb': round(est['mb'],1), 'strategy': [] }
+    if data_format!='raw' and not streaming and est['input_mb']>budget_mb: guard['strategy'].append('streaming')
+    if est['mb']<=budget_mb: return guard
+
+    ratio = budget_mb/est['mb']
+    if est['draws'] and data_format!='summary' and est['draws']*ratio>=min_guard_draws:
+        guard['strategy'].append('thin_draws')
+        guard['draws_kept'] = int(est['draws']*ratio)
+    elif data_format=='raw':
+        guard['strategy'].append('sample_rows')
+        guard['sample_fraction'] = ratio
+    else:
+        raise ValueError(f"Plot data would take about {est['mb']:.0f}MB ({est['rows']} rows), more than the budget of {budget_mb}MB. "
+                          "Filter the data or use fewer factors (or factors with fewer categories)")
+    return guard
+
 # Helper function that handles reformating data for create_plot
+# raw_df can also be a list of per-question frames (see question_strategy in pp_transform_data) that are aggregated separately
+@traced()
 def wrangle_data(raw_df, col_meta, factor_cols, weight_col, pp_desc, n_questions):
     
     plot_meta = get_plot_meta(pp_desc['plot'])
-    schema = raw_df.collect_schema() 
+    raw_dfs = raw_df if isinstance(raw_df,list) else [raw_df]
+    schema = raw_dfs[0].collect_schema() 
     res_col = pp_desc.get('res_col')
     
     draws, continuous, data_format = (plot_meta.get(vn, False) for vn in ['draws','continuous','data_format'])
+    
+    # Some plot args need all the draws, so summary plots fall back to longform for them
+    if data_format=='summary' and any(pp_desc.get('plot_args',{}).get(a) for a in plot_meta.get('longform_args',[])): 
+        data_format = 'longform'
 
     #if pp_desc['res_col'] in factor_cols: factor_cols.remove(pp_desc['res_col']) # Res cannot also be a factor
     
@@ -476,72 +963,71 @@ def wrangle_data(raw_df, col_meta, factor_cols, weight_col, pp_desc, n_questions
     gb_dims = (factor_cols + (['draw'] if draws else []) + 
                 (['id'] if plot_meta.get('data_format') == 'raw' else []))
 
+    # Questions pooled together need to be aggregated together
+    if 'question' not in gb_dims: raw_dfs = [ pl.concat(raw_dfs, how='diagonal_relaxed') ]
+
     # If we have no groupby dimensions, add a dummy one so we don't have to handle the empty case
     if len(gb_dims)==0:
-        raw_df = raw_df.with_columns(pl.lit('dummy').alias('dummy_col'))
+        raw_dfs = [ df.with_columns(pl.lit('dummy').alias('dummy_col')) for df in raw_dfs ]
         gb_dims = ['dummy_col']
     
-    # if draws and 'draw' in schema.names() and 'augment_to' in pp_desc: # Should we try to bootstrap the data to always have augment_to points. Note this is relatively slow
-    #     raw_df = augment_draws(raw_df,gb_dims[1:],threshold=pp_desc['augment_to'])
+    # Bootstrap draws of small groups from across all draws so each has at least augment_to points
+    if draws and 'draw' in schema.names() and pp_desc.get('augment_to'):
+        factors = [ d for d in gb_dims if d not in ['draw','id'] ]
+        raw_dfs = [ augment_draws(df, factors, threshold=pp_desc['augment_to'], seed=pp_desc.get('augment_seed',0)) for df in raw_dfs ]
         
-    pparams = { 'value_col': 'value' }
+    # Estimate the size of the result and change strategy if needed to stay within the memory budget
+    is_categorical = isinstance(schema[res_col], (pl.Categorical, pl.Enum, pl.String))
+    hdis = []
+    if data_format=='summary': # Only ship the statistics of draws the plot needs, with hdi levels given by plot args
+        plot_args, plot_params = pp_desc.get('plot_args',{}), inspect.signature(get_plot_fn(pp_desc['plot'])).parameters
+        hdis = [ plot_args.get(a, plot_params[a].default) for a in plot_meta.get('hdi_args',[]) ]
+    # Raw data plots can be limited to at most this many rows per group of factors, so their cost does not grow with the size of the data
+    group_sample = pp_desc.get('group_sample', plot_meta.get('sample')) if data_format=='raw' else None
+    est = estimate_plot_size(raw_dfs, gb_dims, res_col, weight_col, col_meta, data_format, is_categorical, len(hdis), group_sample)
+    guard = memory_guard(est, pp_desc.get('memory_budget_mb', plot_memory_budget_mb), data_format, pp_desc.get('streaming'))
+
+    if 'thin_draws' in guard['strategy']:
+        kept = trace_collect(raw_dfs[0].select(pl.col('draw').unique().sort().head(guard['draws_kept'])), 'draws')['draw']
+        raw_dfs = [ df.filter(pl.col('draw').is_in(kept)) for df in raw_dfs ]
+    if 'sample_rows' in guard['strategy']: # Deterministic by row id, as for pp_desc['sample']
+        raw_dfs = [ df.filter(pl.col('id').hash(pp_desc.get('sample_seed',0)) < int(guard['sample_fraction']*(2**64-1))) for df in raw_dfs ]
+
+    pparams = { 'value_col': 'value', 'memory_guard': guard, 'summary': data_format=='summary' } # summary tells plots they get statistics of draws
+    if 'thin_draws' in guard['strategy'] or 'sample_rows' in guard['strategy']: pparams['approximate'] = True
 
     if data_format=='raw':
         pparams['value_col'] = res_col
-        if plot_meta.get('sample'):
-            data = (raw_df
-                    .select(gb_dims + [res_col])
-                    .groupby(gb_dims)
-                    .sample(n=plot_meta['sample'], with_replacement=True))
-        else: 
-            data = raw_df.select(gb_dims + [res_col])
+        raw_df = pl.concat(raw_dfs, how='diagonal_relaxed')
+        if group_sample:
+            raw_df = stratified_sample(raw_df, [ d for d in gb_dims if d!='id' ], group_sample, weight_col, pp_desc.get('sample_seed',0))
+            pparams['group_sample'] = group_sample
+        data = raw_df.select(gb_dims + [res_col])
         
-    elif data_format=='longform':
+    elif data_format in ['longform','summary']:
         rc_meta = col_meta.get(res_col,{})
 
         agg_fn = pp_desc.get('agg_fn','mean')
         agg_fn = plot_meta.get('agg_fn',agg_fn)
         
-        # Check if categorical by looking at schema
-        is_categorical = isinstance(schema[res_col], (pl.Categorical, pl.Enum, pl.String))
-
-        if is_categorical:
-            pparams['cat_col'] = res_col 
-            pparams['value_col'] = 'percent'
-            
-            # Aggregate the data
-            data = (raw_df
-                    .group_by(gb_dims + [res_col])
-                    .agg(pl.col(weight_col).sum().alias('percent')))
+        if is_categorical: pparams['cat_col'], pparams['value_col'] = res_col, 'percent'
+        else: pparams['value_col'] = res_col
 
-            # Add weight_col to the data
-            totals = raw_df.group_by(gb_dims).agg(pl.col(weight_col).sum())
-            data = data.join(totals, on=gb_dims)
-                
-            if agg_fn == 'mean':
-                data = data.with_columns( pl.col('percent') / pl.col(weight_col) )
-            elif agg_fn != 'sum':
-                raise Exception(f"Unknown agg_fn: {agg_fn}")
+        # Group on integer category codes instead of categoricals, which the streaming engine does not handle well
+        code_cats = {}
+        if pp_desc.get('streaming') or 'streaming' in guard['strategy']:
+            raw_dfs, code_cats = encode_categoricals(raw_dfs, gb_dims + ([res_col] if is_categorical else []), col_meta)
 
-        else: # Continuous
-            
-            if agg_fn in ['mean','sum']: # Use weighted sum to compute both sum and mean
-                data = (raw_df
-                        .with_columns((pl.col(res_col)*pl.col(weight_col)).alias(res_col))
-                        .group_by(gb_dims)
-                        .agg(pl.col([res_col,weight_col]).sum()))
-                if agg_fn == 'mean':
-                    data = data.with_columns(pl.col(res_col)/pl.col(weight_col).alias(res_col))
-            else:  # median, min, max, etc. - ignore weight_col
-                data = (raw_df
-                        .group_by(gb_dims)
-                        .agg([getattr(pl.col(res_col), agg_fn)().alias(res_col), pl.col(weight_col).sum()]))                    
-                
-            pparams['value_col'] = res_col
+        # Aggregate each frame separately - the results are small, so concatenating them is cheap
+        data = pl.concat([ aggregate_longform(df, gb_dims, res_col, weight_col, agg_fn, is_categorical) for df in raw_dfs ],
+                         how='vertical_relaxed')
 
         if plot_meta.get('group_sizes'): 
             data = data.rename({weight_col:'group_size'})
         else: data = data.drop(weight_col)
+
+        if data_format=='summary':
+            data = summarize_draws(data, [ d for d in gb_dims if d!='draw' ] + ([res_col] if is_categorical else []), pparams['value_col'], hdis)
     else:
         raise Exception("Unknown data_format")
 
@@ -552,30 +1038,42 @@ def wrangle_data(raw_df, col_meta, factor_cols, weight_col, pp_desc, n_questions
     # For new_stream, polars 1.23 considers categoricals to still be broken
     # TODO: Check back here when 1.24+ is released
     #print("final\n",data.explain(streaming=True))
-    data = data.collect(streaming=True).to_pandas()
+    data = trace_collect(data, streaming=True)
+    if pparams.get('group_sample') and data.height<est['input_rows']: pparams['approximate'] = True # Some groups had more rows
+    if pp_desc.get('native'): # Keep the data in polars (and Arrow) all the way to the plot
+        if data_format!='raw': data = decode_categoricals_pl(data, code_cats)
+    else:
+        with trace_span('to_pandas', rows=data.height): data = data.to_pandas()
+        if data_format!='raw': data = decode_categoricals(data, code_cats)
     #print("DATA\n",data)
 
     # How many datapoints the plot is based on. This is useful metainfo to display sometimes
-    pparams['filtered_size'] = raw_df.select(pl.col(weight_col).sum()).collect().item()/n_questions
+    pparams['filtered_size'] = est['weight']*len(raw_dfs)/n_questions
 
     # Fix categorical types that polars does not read properly from parquet
     # Also filter out unused categories so plots are cleaner
-    for c in data.columns:
-        if col_meta.get(c,{}).get('categories'): 
-            m_cats = col_meta[c]['categories'] if col_meta[c].get('categories','infer')!='infer' else None
-            f_cats = get_cats(data[c],m_cats) if c != pp_desc['res_col'] or not col_meta[c].get('likert') else m_cats # Do not trim likert as plots need to be symmetric
-            data[c] = pd.Categorical(data[c],f_cats,ordered=col_meta[c].get('ordered',False))
+    with trace_span('fix_categories'):
+        if pp_desc.get('native'): data = fix_categories_pl(data, col_meta, pp_desc['res_col'], skip=summary_stats if data_format=='summary' else [])
+        else:
+            for c in data.columns:
+                if data_format=='summary' and c in summary_stats: continue # Statistics can share a name with a data column (like q1)
+                if col_meta.get(c,{}).get('categories'): 
+                    m_cats = col_meta[c]['categories'] if col_meta[c].get('categories','infer')!='infer' else None
+                    f_cats = get_cats(data[c],m_cats) if c != pp_desc['res_col'] or not col_meta[c].get('likert') else m_cats # Do not trim likert as plots need to be symmetric
+                    data[c] = pd.Categorical(data[c],f_cats,ordered=col_meta[c].get('ordered',False))
 
     pparams['col_meta'] = col_meta # As this has been adjusted for discretization etc
     pparams['data'] = data
 
     return pparams
 
-# %% ../nbs/02_pp.ipynb 27
+# %% ../nbs/02_pp.ipynb 42
 # Create a color scale
-def meta_color_scale(scale: Optional[Dict], column=None, translate=None):
-    cats = column.dtype.categories if column.dtype.name=='category' else None
-    if scale is None and column is not None and column.dtype.name=='category' and column.dtype.ordered:
+# Polars columns do not know if their categories are ordered, so for them it is given by ordered
+def meta_color_scale(scale: Optional[Dict], column=None, translate=None, ordered=False):
+    cats = column_categories(column)
+    if not isinstance(column, pl.Series): ordered = cats is not None and column.dtype.ordered
+    if scale is None and cats is not None and ordered:
         scale = dict(zip(cats,gradient_to_discrete_color_scale(default_bidirectional_gradient, len(cats))))
     if translate and cats is not None:
         remap = dict(zip(cats,[ translate(c) for c in cats ]))
@@ -583,9 +1081,56 @@ def meta_color_scale(scale: Optional[Dict], column=None, translate=None):
         cats = [ remap[c] for c in cats ]
     return to_alt_scale(scale,cats)
 
-# %% ../nbs/02_pp.ipynb 28
+# %% ../nbs/02_pp.ipynb 43
+# Memoized translation: translations are kept in a dict and translate is only called for strings not seen before
+# Column names and categories of col_meta can be added up front, so translating plot data is just dict lookups
+class TranslationTable(dict):
+    def __init__(self, translate, col_meta=None):
+        super().__init__()
+        self.translate = translate
+        if col_meta: self.add_meta(col_meta)
+
+    def add_meta(self, col_meta):
+        for c, cm in col_meta.items():
+            self(c)
+            if isinstance(cm.get('categories'), list): 
+                for v in cm['categories']: self(v)
+
+    def __missing__(self, s):
+        self[s] = res = self.translate(s)
+        return res
+
+    def __call__(self, s):
+        try: return self[s]
+        except TypeError: return self.translate(s) # Unhashable values
+
+# Tables built once per key, f.e. (dataset, translation file), so they can be reused across plots and reruns
+# create_plot does not know the dataset, so it only builds a table for a single plot unless it is given one (as the dashboard does)
+translation_tables, translation_tables_size = {}, 16
+def get_translation_table(translate, data_meta=None, key=None):
+    if isinstance(translate, TranslationTable): return translate
+    if key is None: return TranslationTable(translate) # Only memoizes within a single plot
+
+    if key not in translation_tables:
+        if len(translation_tables)>=translation_tables_size: del translation_tables[next(iter(translation_tables))]
+        translation_tables[key] = TranslationTable(translate, extract_column_meta(data_meta) if data_meta else None)
+    return translation_tables[key]
+
+# %% ../nbs/02_pp.ipynb 45
+def rename_columns(df, mapping):
+    return df.rename(mapping) if isinstance(df, pl.DataFrame) else df.rename(columns=mapping)
+
 def translate_df(df, translate):
-    df.columns = [ (translate(c) if c not in special_columns else c) for c in df.columns ]
+    if isinstance(df, pl.DataFrame):
+        df, casts = df.rename({ c: translate(c) for c in df.columns if c not in special_columns+summary_stats }), []
+        for c in df.columns:
+            cats = column_categories(df[c])
+            if cats is None: continue
+            tcats = [ translate(v) for v in cats ]
+            casts.append(pl.col(c).cast(pl.String).replace(dict(zip(cats,tcats))).cast(pl.Enum(tcats)))
+        return df.with_columns(casts)
+
+    df.columns = [ (translate(c) if c not in special_columns+summary_stats else c) for c in df.columns ]
     for c in df.columns:
         if df[c].dtype.name == 'category':
             cats = df[c].dtype.categories
@@ -593,7 +1138,8 @@ def translate_df(df, translate):
             df[c] = df[c].cat.rename_categories(remap)
     return df
 
-# %% ../nbs/02_pp.ipynb 29
+# %% ../nbs/02_pp.ipynb 46
+@traced('tooltip')
 def create_tooltip(pparams,tc_meta):
     
     data, tfn = pparams['data'], pparams['translate']
@@ -616,7 +1162,9 @@ def create_tooltip(pparams,tc_meta):
     tooltips = [ alt.Tooltip(f"{pparams['value_col']}:Q", format=pparams['val_format']) ]
     for cn in tcols:
         if label_dict.get(cn):
-            data[cn+'_label'] = data[cn].astype('object').replace({ k:tfn(v) for k,v in label_dict[cn].items() })
+            if isinstance(data, pl.DataFrame):
+                pparams['data'] = data = data.with_columns(pl.col(cn).cast(pl.String).replace({ k:tfn(v) for k,v in label_dict[cn].items() }).alias(cn+'_label'))
+            else: data[cn+'_label'] = data[cn].astype('object').replace({ k:tfn(v) for k,v in label_dict[cn].items() })
             t = alt.Tooltip(f"{cn}_label:N",title=cn)
         else:
             t = alt.Tooltip(f"{cn}:N")
@@ -625,7 +1173,7 @@ def create_tooltip(pparams,tc_meta):
     return tooltips
     
 
-# %% ../nbs/02_pp.ipynb 30
+# %% ../nbs/02_pp.ipynb 47
 # Small helper function to move columns from internal to external columns
 def remove_from_internal_fcols(cname, factor_cols, n_inner):
     if cname not in factor_cols[:n_inner]: return n_inner
@@ -648,9 +1196,43 @@ def inner_outer_factors(factor_cols, pp_desc, plot_meta):
     
     return factor_cols, n_inner
 
-# %% ../nbs/02_pp.ipynb 31
+# %% ../nbs/02_pp.ipynb 48
+# Lazy 2d matrix of plots, as returned by create_plot with return_matrix_of_plots
+# Behaves like a list of rows of plots, but each plot is only created when first accessed
+# Slicing it gives a page of rows, f.e. pmat[:5] for the first five rows
+class PlotMatrix:
+    def __init__(self, make_plot, keys, n_cols, cache=None):
+        self.make_plot, self.keys, self.n_cols = make_plot, list(keys), n_cols
+        self.cache = {} if cache is None else cache
+
+    def plot(self, key):
+        if key not in self.cache: self.cache[key] = self.make_plot(key)
+        return self.cache[key]
+
+    def __len__(self): return -(-len(self.keys)//self.n_cols)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            rows = range(len(self))[i]
+            if rows.step != 1: raise ValueError("PlotMatrix only supports contiguous slices")
+            return PlotMatrix(self.make_plot, self.keys[rows.start*self.n_cols:rows.stop*self.n_cols], self.n_cols, self.cache)
+        i = range(len(self))[i] # Handles negative indices and raises IndexError
+        return PlotMatrixRow(self, self.keys[i*self.n_cols:(i+1)*self.n_cols])
+
+    def __iter__(self): return (self[i] for i in range(len(self)))
+
+    def to_list(self): return [ list(row) for row in self ]
+
+class PlotMatrixRow:
+    def __init__(self, pmat, keys): self.pmat, self.keys = pmat, keys
+    def __len__(self): return len(self.keys)
+    def __getitem__(self, j): return self.pmat.plot(self.keys[j])
+    def __iter__(self): return (self.pmat.plot(k) for k in self.keys)
+
+# %% ../nbs/02_pp.ipynb 50
 # Function that takes filtered raw data and plot information and outputs the plot
 # Handles all of the data wrangling and parameter formatting
+@traced()
 def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None, dry_run=False, width=200, height=None, return_matrix_of_plots=False, translate=None):
     data, col_meta = pparams['data'], pparams['col_meta']
 
@@ -665,6 +1247,12 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
     # Get list of factor columns (adding question and category if needed)
     factor_cols, n_inner = inner_outer_factors(pp_desc['factor_cols'], pp_desc, plot_meta)
 
+    # Polars data (see native in pp_desc) is passed as is to plots registered with native=True
+    # Other plots, and the steps below that are written for pandas, get it converted to pandas
+    if isinstance(data, pl.DataFrame) and (not plot_meta.get('native') or pp_desc.get('sort') or return_matrix_of_plots
+                                           or plot_meta.get('no_faceting') or plot_meta.get('as_is') or len(factor_cols)-n_inner>2):
+        with trace_span('to_pandas', rows=data.height): data = pparams['data'] = plot_data_to_pandas(data, col_meta)
+
     # Reorder categories if required
     if pp_desc.get('sort'):
         for cn in pp_desc['sort']:
@@ -686,7 +1274,7 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
     
     # Handle translation funcion
     if translate is None: translate = (lambda s: s)
-    pparams['translate'] = translate
+    pparams['translate'] = translate = get_translation_table(translate)
 
     # Handle internal facets (and translate as needed)
     pparams['facets'] = []
@@ -696,8 +1284,8 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
             fd = {
                 'col': translate(cn),
                 'ocol': cn,
-                'order': [ translate(c) for c in data[cn].dtype.categories ],
-                'colors': meta_color_scale(col_meta[cn].get('colors',None), data[cn], translate=translate), 
+                'order': [ translate(c) for c in column_categories(data[cn]) ],
+                'colors': meta_color_scale(col_meta[cn].get('colors',None), data[cn], translate=translate, ordered=col_meta[cn].get('ordered',False)), 
             }
             pparams['facets'].append(fd)
 
@@ -710,7 +1298,7 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
 
     if plot_meta.get('no_faceting') and len(factor_cols)>0: return_matrix_of_plots = True
 
-    pparams['value_range'] = tuple(data[pparams['value_col']].agg(['min','max']))
+    pparams['value_range'] = (data[pparams['value_col']].min(), data[pparams['value_col']].max())
 
     pparams['outer_colors'] = col_meta[factor_cols[0]].get('colors', {}) if factor_cols else {}
 
@@ -722,40 +1310,44 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
             label = pparams['value_col']
             if label.startswith(prefix) and label!=prefix:
                 label = pparams['value_col'][len(prefix):]
-        data = data.rename(columns={pparams['value_col']: label})
+        data = rename_columns(data, {pparams['value_col']: label})
         pparams['value_col'] = label
 
     # Translate the data itself
-    pparams['data'] = data = translate_df(data,translate)
-    pparams['value_col'] = translate(pparams['value_col'])  
-    factor_cols = [ translate(c) for c in factor_cols ]
-    t_col_meta = { translate(c): v for c,v in col_meta.items() }
+    with trace_span('translate'):
+        pparams['data'] = data = translate_df(data,translate)
+        pparams['value_col'] = translate(pparams['value_col'])  
+        factor_cols = [ translate(c) for c in factor_cols ]
+        t_col_meta = { translate(c): v for c,v in col_meta.items() }
 
     # Handle tooltip
     pparams['tooltip'] = create_tooltip(pparams,t_col_meta)
     
     # If we still have more than 1 factor left, merge the rest into one so we have a 2d facet
     if len(factor_cols)>1:
-        n_facet_cols = len(data[factor_cols[-1]].dtype.categories)
+        n_facet_cols = len(column_categories(data[factor_cols[-1]]))
         if not return_matrix_of_plots and len(factor_cols)>2:
 
-            # Preserve ordering of categories we combine
+            # Preserve ordering of categories we combine, computing the codes of the combination from codes of its parts
             nf_order = [ ', '.join(t) for t in it.product(*[list(data[c].dtype.categories) for c in factor_cols[1:]])]
             factor_col = ', '.join(factor_cols[1:])
-            jfs = data[factor_cols[1:]].agg(', '.join, axis=1)
-            data.loc[:,factor_col] = pd.Categorical(jfs,nf_order)
+            codes = np.zeros(len(data),dtype=int)
+            for c in factor_cols[1:]: 
+                codes = codes*len(data[c].dtype.categories) + data[c].cat.codes.to_numpy()
+            codes[(data[factor_cols[1:]].isna()).any(axis=1).to_numpy()] = -1
+            data.loc[:,factor_col] = pd.Categorical.from_codes(codes,nf_order)
             pparams['data'] = data
             factor_cols = [factor_cols[0], factor_col]
 
         if len(factor_cols)>=2:
             factor_cols = list(reversed(factor_cols))
-            n_facet_cols = len(data[factor_cols[1]].dtype.categories)
+            n_facet_cols = len(column_categories(data[factor_cols[1]]))
     else:
         n_facet_cols = plot_meta.get('factor_columns',1)
         
     # Allow value col name to be changed. This can be useful in distinguishing different aggregation options for a column
     if 'value_name' in pp_desc: 
-        pparams['data'] = pparams['data'].rename(columns={pparams['value_col']:pp_desc['value_name']})
+        pparams['data'] = rename_columns(pparams['data'], {pparams['value_col']:pp_desc['value_name']})
         pparams['value_col'] = pp_desc['value_name']
     
     # Do width/height calculations
@@ -774,27 +1366,28 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
     # Trim down parameters list if needed
     plot_fn = get_plot_fn(pp_desc['plot'])
     pparams = clean_kwargs(plot_fn,pparams)
+    plot_fn = traced('plot_fn')(plot_fn) # Only after clean_kwargs, as it needs the signature of the original
     if alt_wrapper is None: alt_wrapper = lambda p: p
     if plot_meta.get('as_is'): # if as_is set, just return the plot as-is
         return plot_fn(**pparams)
     elif factor_cols:
-        if return_matrix_of_plots: # return a 2d list of plots which can be rendeed one plot at a time
+        if return_matrix_of_plots: # return a lazy 2d matrix of plots which are created when rendered one plot at a time
             del pparams['data']
             combs = it.product( *[data[fc].dtype.categories for fc in factor_cols ])
-            return list(batch([
-                alt_wrapper(plot_fn(data[(data[factor_cols]==c).all(axis=1)],**pparams)
-                            .properties(title='-'.join(map(str,c)),**dims, **alt_properties)
-                            .configure_view(discreteHeight={'step':20}))
-                for c in combs
-                ], n_facet_cols))
+            inds = { (k if isinstance(k,tuple) else (k,)): v for k, v in data.groupby(factor_cols,observed=True).indices.items() }
+            def make_plot(c):
+                return alt_wrapper(plot_fn(data.iloc[inds.get(c,[])],**pparams)
+                                   .properties(title='-'.join(map(str,c)),**dims, **alt_properties)
+                                   .configure_view(discreteHeight={'step':20}))
+            return PlotMatrix(make_plot, combs, n_facet_cols)
         else: # Use faceting
             if n_facet_cols==1:
                 plot = alt_wrapper(plot_fn(**pparams).properties(**dims, **alt_properties).facet(
-                    row=alt.Row(f'{factor_cols[0]}:O', sort=list(data[factor_cols[0]].dtype.categories), header=alt.Header(labelOrient='top'))))
-            elif n_facet_cols==len(data[factor_cols[0]].dtype.categories):
+                    row=alt.Row(f'{factor_cols[0]}:O', sort=column_categories(data[factor_cols[0]]), header=alt.Header(labelOrient='top'))))
+            elif n_facet_cols==len(column_categories(data[factor_cols[0]])):
                 plot = alt_wrapper(plot_fn(**pparams).properties(**dims, **alt_properties).facet(
-                    column=alt.Column(f'{factor_cols[1]}:O', sort=list(data[factor_cols[1]].dtype.categories)),
-                    row=alt.Row(f'{factor_cols[0]}:O', sort=list(data[factor_cols[0]].dtype.categories), header=alt.Header(labelOrient='top'))))
+                    column=alt.Column(f'{factor_cols[1]}:O', sort=column_categories(data[factor_cols[1]])),
+                    row=alt.Row(f'{factor_cols[0]}:O', sort=column_categories(data[factor_cols[0]]), header=alt.Header(labelOrient='top'))))
             else: # n_facet_cols!=1 but just one facet
                 plot = alt_wrapper(plot_fn(**pparams).properties(**dims, **alt_properties).facet(f'{factor_cols[0]}:O',columns=n_facet_cols))
             plot = plot.configure_view(discreteHeight={'step':20})
@@ -802,12 +1395,139 @@ def create_plot(pparams, data_meta, pp_desc, alt_properties={}, alt_wrapper=None
         plot = alt_wrapper(plot_fn(**pparams).properties(**dims, **alt_properties)
                             .configure_view(discreteHeight={'step':20}))
 
-        if return_matrix_of_plots: plot = [[plot]]
+        if return_matrix_of_plots: plot = PlotMatrix(lambda c, plot=plot: plot, [()], 1)
 
     return plot
 
 
-# %% ../nbs/02_pp.ipynb 33
+# %% ../nbs/02_pp.ipynb 52
+# Serialize a dataframe as csv for Vega-Lite, along with the parse types needed to restore its columns
+# Csv lists column names only once and is written by polars, so it is much smaller and faster than altair's row-wise json
+def vl_csv_data(df):
+    parse = {}
+    if isinstance(df, pl.DataFrame): # Polars data is written directly, with Enums as their labels
+        for c, dtype in df.schema.items():
+            parse[c] = 'boolean' if dtype==pl.Boolean else 'number' if dtype.is_numeric() else 'date' if dtype.is_temporal() else 'string'
+        return df.write_csv(), parse
+
+    for c, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype): dtype = dtype.categories.dtype
+        if pd.api.types.is_bool_dtype(dtype): parse[c] = 'boolean'
+        elif pd.api.types.is_numeric_dtype(dtype): parse[c] = 'number'
+        elif pd.api.types.is_datetime64_any_dtype(dtype): parse[c] = 'date'
+        else: parse[c] = 'string' # Also makes empty strings null again
+    try: csv = pl.from_pandas(df).write_csv()
+    except Exception: # Mixed type object columns etc - fall back to pandas
+        csv = df.astype({ c: 'string' for c,t in parse.items() if t=='string' }).to_csv(index=False)
+    return csv, parse
+
+# Return a shallow copy of an altair plot where all dataframes (including in layers, concats and facet specs) are replaced by fn(df)
+def replace_plot_data(plot, fn):
+    plot = plot.copy(deep=False)
+    if isinstance(plot._get('data'), (pd.DataFrame, pl.DataFrame)): plot.data = fn(plot.data)
+    for k in ['layer','hconcat','vconcat','concat']:
+        if isinstance(plot._get(k), list): plot[k] = [ replace_plot_data(p,fn) for p in plot[k] ]
+    if isinstance(plot._get('spec'), alt.SchemaBase): plot.spec = replace_plot_data(plot.spec, fn)
+    return plot
+
+# Convert an altair plot to a Vega-Lite spec where data is passed by reference
+# Each distinct dataframe is serialized only once and named by the hash of its content, with all layers and facets referring to it by name
+# If data_url is given, data is referenced as data_url + name + '.csv' instead and the csv payloads are stored in payloads for serving separately
+@traced()
+def plot_to_spec(plot, data_url=None, payloads=None, validate=True):
+    if data_url is not None and payloads is None:
+        raise ValueError('payloads dict needs to be provided when data_url is used')
+    datasets, refs = {}, {}
+    def to_ref(df):
+        if id(df) not in refs:
+            csv, parse = vl_csv_data(df)
+            name = 'data-' + hashlib.sha256(csv.encode()).hexdigest()[:32]
+            datasets[name] = csv
+            refs[id(df)] = { **({'url': f'{data_url}{name}.csv'} if data_url is not None else {'name': name}),
+                             'format': {'type': 'csv', 'parse': parse} }
+        return refs[id(df)]
+
+    spec = replace_plot_data(plot, to_ref).to_dict(validate=validate)
+    if data_url is not None: payloads.update(datasets)
+    elif datasets: spec['datasets'] = { **spec.get('datasets',{}), **datasets }
+    return spec
+
+# %% ../nbs/02_pp.ipynb 54
+# Memo cache of the specs of recently drawn plots, keyed by plot type, faceting layout, parameters and a hash of the data
+# It only helps when exactly the same plot is drawn again, as many plots derive scales and legends from the data values
+spec_cache, spec_cache_size = {}, 32
+
+# Objects that can not be keyed by value (like translate functions) are keyed by identity
+# and returned in refs, so they can be kept alive with the cache entry and their id is not reused
+def spec_cache_key(pparams, pp_desc, kwargs):
+    refs = []
+    def by_id(o):
+        if hasattr(o,'tolist'): return o.tolist() # numpy values and arrays
+        refs.append(o); return f'{type(o).__name__}@{id(o)}'
+
+    data = pparams['data']
+    if isinstance(data, pl.DataFrame):
+        h = hashlib.sha256(data.hash_rows().to_numpy().tobytes())
+        h.update(repr(list(data.schema.items())).encode())
+    else:
+        h = hashlib.sha256(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        h.update(repr(list(data.dtypes.items())).encode())
+    rest = { k: v for k,v in pparams.items() if k!='data' }
+    kwargs = { k: (by_id(v) if callable(v) else v) for k,v in kwargs.items() }
+    h.update(json.dumps([rest, pp_desc, kwargs, by_id(get_plot_fn(pp_desc['plot']))], sort_keys=True, default=by_id).encode())
+    return h.hexdigest(), refs
+
+# Fast version of create_plot that returns Vega-Lite spec dicts (or a PlotMatrix of them) instead of altair plots
+# Specs are serialized without validating the whole spec against the schema again, and are the same as create_plot(...).to_dict()
+# Altair validation is a global flag, so it is left alone here and the parts of the plot are still validated as they are created
+# Specs are cached, so drawing the same plot again is nearly free. They are shared between calls so should not be modified
+@traced()
+def create_plot_spec(pparams, data_meta, pp_desc, **kwargs):
+    if kwargs.get('dry_run'): return create_plot(pparams, data_meta, pp_desc, **kwargs)
+    key, refs = spec_cache_key(pparams, pp_desc, kwargs)
+
+    if key not in spec_cache:
+        plot = create_plot(pparams, data_meta, pp_desc, **kwargs)
+        with trace_span('serialize'):
+            if isinstance(plot, PlotMatrix): spec = PlotMatrix(lambda c, make_plot=plot.make_plot: make_plot(c).to_dict(validate=False), plot.keys, plot.n_cols)
+            else: spec = plot.to_dict(validate=False)
+
+        if len(spec_cache)>=spec_cache_size: del spec_cache[next(iter(spec_cache))]
+        spec_cache[key] = (spec, refs)
+    return spec_cache[key][0]
+
+# %% ../nbs/02_pp.ipynb 57
+# Keep only the filters on columns present in the dataset, so the same description can be used across files (like different waves)
+def prune_filter(pp_desc, columns):
+    return { **pp_desc, 'filter': { k:v for k,v in pp_desc.get('filter',{}).items() if k in columns } }
+
+# Run pp_transform_data on several datasets at once, returning the list of pparams in the same order
+# Polars releases the GIL while executing the queries, so they run concurrently in a thread pool
+# data_metas can be a list (one per dataset) or a single meta shared by all. Column lists are read from the data if not given
+def pp_transform_data_many(full_dfs, data_metas, pp_desc, columns=None, max_workers=None):
+    if not isinstance(data_metas, list): data_metas = [data_metas]*len(full_dfs)
+    if columns is None: columns = [ df.collect_schema().names() if hasattr(df,'collect_schema') else list(df.columns) for df in full_dfs ]
+    if len(full_dfs)<=1: return [ pp_transform_data(df, dm, prune_filter(pp_desc, cols)) for df, dm, cols in zip(full_dfs, data_metas, columns) ]
+
+    # Each worker gets its own copy of the meta and of the lazy frame, as polars does not allow one LazyFrame object to be used from several threads at once
+    clone = lambda df: df.clone() if isinstance(df, pl.LazyFrame) else df
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(full_dfs)) as pool:
+        futures = [ pool.submit(contextvars.copy_context().run, pp_transform_data, clone(df), copy.deepcopy(dm), prune_filter(pp_desc, cols)) # Keeps tracing
+                    for df, dm, cols in zip(full_dfs, data_metas, columns) ]
+        return [ f.result() for f in futures ]
+
+# Batch version of create_plot for the results of pp_transform_data_many
+# data_metas and pp_descs can be lists or shared by all, and keyword arguments given as lists (like width) are per plot
+# Building plots is pure python so it is not helped by threads, but specs come from the cache when as_spec=True
+def create_plot_many(pparams_list, data_metas, pp_descs, as_spec=False, **kwargs):
+    n = len(pparams_list)
+    per_plot = lambda v: v if isinstance(v, list) else [v]*n
+    make_plot = create_plot_spec if as_spec else create_plot
+    kwargs = { k: per_plot(v) for k,v in kwargs.items() }
+    return [ make_plot(pparams, dm, desc, **{ k: v[i] for k,v in kwargs.items() })
+             for i, (pparams, dm, desc) in enumerate(zip(pparams_list, per_plot(data_metas), per_plot(pp_descs))) ]
+
+# %% ../nbs/02_pp.ipynb 61
 # Compute the full factor_cols list, including question and res_col as needed
 def impute_factor_cols(pp_desc, col_meta, plot_meta=None):
     factor_cols = pp_desc.get('factor_cols',[]).copy()
@@ -833,13 +1553,36 @@ def impute_factor_cols(pp_desc, col_meta, plot_meta=None):
 
     return factor_cols
 
-# %% ../nbs/02_pp.ipynb 34
+# %% ../nbs/02_pp.ipynb 62
 # A convenience function to draw a plot straight from a dataset
-def e2e_plot(pp_desc, data_file=None, full_df=None, data_meta=None, width=800, height=None, check_match=True, impute=True, **kwargs):
+# If progressive is a function, quick approximate plots are passed to it as progressive(plot, pparams) before the final plot is returned
+# With as_spec=True, Vega-Lite spec dicts are returned instead of altair plots (see create_plot_spec)
+@traced()
+def e2e_plot(pp_desc, data_file=None, full_df=None, data_meta=None, width=800, height=None, check_match=True, impute=True, progressive=None, as_spec=False, **kwargs):
+    full_df, data_meta, pp_desc = e2e_prepare(pp_desc, data_file, full_df, data_meta, check_match, impute)
+
+    make_plot = create_plot_spec if as_spec else create_plot
+    if progressive is not None:
+        for pparams in pp_transform_data_progressive(full_df, data_meta, pp_desc):
+            # Each step gets its own copy, as create_plot reorders factor_cols in place (see inner_outer_factors)
+            plot = make_plot(pparams, data_meta, copy.deepcopy(pp_desc), width=width,height=height,**kwargs)
+            if pparams.get('approximate'): progressive(plot, pparams)
+        return plot
+
+    pparams = pp_transform_data(full_df, data_meta, pp_desc)
+    return make_plot(pparams, data_meta, pp_desc, width=width,height=height,**kwargs)
+
+# Load the data (if needed), impute factor columns and check the plot can be drawn
+# The fingerprint of the data (see file_fingerprint) allows plot matching to be cached when the data is not read from data_file
+@traced('prepare')
+def e2e_prepare(pp_desc, data_file, full_df, data_meta, check_match=True, impute=True, fingerprint=None):
     if data_file is None and full_df is None:
         raise Exception('Data must be provided either as data_file or full_df')
     if data_file is None and data_meta is None:
         raise Exception('If data provided as full_df then data_meta must also be given')
+
+    # Plot matching can only be cached if both data and meta come from the file
+    if fingerprint is None and data_file is not None and full_df is None and data_meta is None: fingerprint = file_fingerprint(data_file)
         
     if full_df is None: 
         full_df, dm = read_annotated_data_lazy(data_file)
@@ -849,16 +1592,15 @@ def e2e_plot(pp_desc, data_file=None, full_df=None, data_meta=None, width=800, h
     if impute: pp_desc['factor_cols'] = impute_factor_cols(pp_desc, extract_column_meta(data_meta), get_plot_meta(pp_desc['plot']))
 
     if check_match:
-        matches = matching_plots(pp_desc, full_df, data_meta, details=True, list_hidden=True)    
+        matches = matching_plots(pp_desc, full_df, data_meta, details=True, list_hidden=True, fingerprint=fingerprint)    
         if pp_desc['plot'] not in matches: 
             raise Exception(f"Plot not registered: {pp_desc['plot']}")
         
         fit, imp = matches[pp_desc['plot']]
         if  fit<0:
             raise Exception(f"Plot {pp_desc['plot']} not applicable in this situation because of flags {imp}")
-            
-    pparams = pp_transform_data(full_df, data_meta, pp_desc)
-    return create_plot(pparams, data_meta, pp_desc, width=width,height=height,**kwargs)
+
+    return full_df, data_meta, pp_desc
 
 # Another convenience function to simplify testing new plots
 def test_new_plot(fn, pp_desc, *args, plot_meta={}, **kwargs):
@@ -867,3 +1609,60 @@ def test_new_plot(fn, pp_desc, *args, plot_meta={}, **kwargs):
     res = e2e_plot(pp_desc,*args,**kwargs)
     stk_deregister('test') # And de-register it again
     return res
+
+# %% ../nbs/02_pp.ipynb 63
+# Async versions of the plot pipeline, for serving plots from an async web backend
+# Blocking work runs in an executor (the default thread pool unless one is given) so the event loop is never blocked.
+# Data processing is the heavy part so the number of such jobs running at once is limited by a semaphore (per event loop)
+# Plots are registered at import time and only read afterwards, so sharing the registry between threads is safe
+async_plot_limit = 4
+async_semaphores = weakref.WeakKeyDictionary()
+
+def async_semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in async_semaphores: async_semaphores[loop] = asyncio.Semaphore(async_plot_limit)
+    return async_semaphores[loop]
+
+# String cache is global in polars, but make sure it is enabled before categoricals from different sources are combined
+def with_string_cache(fn, *args, **kwargs):
+    pl.enable_string_cache()
+    return fn(*args, **kwargs)
+
+# Run fn in the executor. If the awaiting task is cancelled (like when the client disconnects), CancelledError is raised right away,
+# but the semaphore slot is only freed once the thread finishes, as a running polars query can not be interrupted
+async def run_in_executor(fn, *args, executor=None, semaphore=None, **kwargs):
+    if semaphore is not None: await semaphore.acquire()
+    ctx = contextvars.copy_context() # Like asyncio.to_thread, so context (like tracing) carries over to the thread
+    try: fut = asyncio.get_running_loop().run_in_executor(executor, functools.partial(ctx.run, with_string_cache, fn, *args, **kwargs))
+    except BaseException:
+        if semaphore is not None: semaphore.release()
+        raise
+
+    def done(f):
+        if semaphore is not None: semaphore.release()
+        if not f.cancelled(): f.exception() # Retrieve it so an abandoned job does not log an unretrieved exception
+    fut.add_done_callback(done)
+    return await asyncio.shield(fut)
+
+async def async_pp_transform_data(full_df, data_meta, pp_desc, executor=None, semaphore=None, **kwargs):
+    return await run_in_executor(pp_transform_data, full_df, data_meta, pp_desc, **kwargs, executor=executor, semaphore=semaphore or async_semaphore())
+
+# Always returns specs (see create_plot_spec), as altair plots are not thread safe to render while being modified
+# Plots without faceting give rows of specs instead of a lazy PlotMatrix, so all of them are built in the executor
+async def async_create_plot_spec(pparams, data_meta, pp_desc, executor=None, **kwargs):
+    def make_spec():
+        spec = create_plot_spec(pparams, data_meta, pp_desc, **kwargs)
+        return spec.to_list() if isinstance(spec, PlotMatrix) else spec
+    return await run_in_executor(make_spec, executor=executor)
+
+# Async version of e2e_plot, returning Vega-Lite spec dicts
+# Loading and processing the data counts as one heavy job, so a request holds at most one semaphore slot
+async def async_e2e_plot(pp_desc, data_file=None, full_df=None, data_meta=None, width=800, height=None, check_match=True, impute=True,
+                         executor=None, semaphore=None, **kwargs):
+    # Concurrent requests often share one LazyFrame, which polars does not allow to be used from several threads at once
+    if isinstance(full_df, pl.LazyFrame): full_df = full_df.clone()
+    def process():
+        full_df_, data_meta_, pp_desc_ = e2e_prepare(pp_desc, data_file, full_df, data_meta, check_match, impute)
+        return pp_transform_data(full_df_, data_meta_, pp_desc_), data_meta_, pp_desc_
+    pparams, data_meta, pp_desc = await run_in_executor(process, executor=executor, semaphore=semaphore or async_semaphore())
+    return await async_create_plot_spec(pparams, data_meta, pp_desc, width=width, height=height, executor=executor, **kwargs)
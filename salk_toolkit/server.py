@@ -0,0 +1,161 @@
+"""Headless server that draws plots from a shared cache of annotated data files, so dashboards can be thin clients"""
+
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/08_server.ipynb.
+
+# %% auto 0
+__all__ = ['plot_options', 'RequestError', 'PlotServer', 'main']
+
+# %% ../nbs/08_server.ipynb 3
+import argparse, concurrent.futures, glob, hashlib, json, os, threading, time, traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import polars as pl
+import pyarrow as pa
+
+from salk_toolkit.io import read_annotated_data_lazy, file_fingerprint
+from salk_toolkit.pp import e2e_prepare, pp_transform_data, create_plot_spec, get_translation_table, PlotMatrix
+
+# %% ../nbs/08_server.ipynb 5
+# Options passed on to create_plot
+plot_options = ['width', 'height', 'alt_properties']
+
+# Errors caused by the request rather than the server
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class PlotServer:
+    def __init__(self, files, workers=4, cache_size=256):
+        self.files = { os.path.basename(f): f for f in files }
+        self.datasets, self.load_lock = {}, threading.Lock()
+        self.responses, self.cache_size, self.cache_lock = {}, cache_size, threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    # Return the dataset, (re)loading it if it is not loaded or the file has changed
+    def get_dataset(self, name):
+        if name not in self.files: raise RequestError(f'Unknown data file: {name}', 404)
+        fingerprint = file_fingerprint(self.files[name])
+        with self.load_lock:
+            ds = self.datasets.get(name)
+            if ds is None or ds['fingerprint']!=fingerprint:
+                ldf, data_meta = read_annotated_data_lazy(self.files[name])
+                ds = self.datasets[name] = { 'data': ldf, 'data_meta': data_meta, 'fingerprint': fingerprint }
+            # Each request gets its own handle, as polars does not allow one LazyFrame to be used from several threads at once
+            return { **ds, 'data': ds['data'].clone() }
+
+    # Draw a plot (or aggregate its data) for a request. Returns content type, body and timings of the steps
+    def plot(self, req):
+        timings, t0 = {}, time.perf_counter()
+        def step(name):
+            nonlocal t0
+            t = time.perf_counter(); timings[name] = t-t0; t0 = t
+
+        if not isinstance(req, dict) or 'data_file' not in req or 'pp_desc' not in req:
+            raise RequestError('Request must have data_file and pp_desc')
+        output = req.get('output', 'spec')
+        if output not in ['spec', 'json', 'arrow']: raise RequestError(f'Unknown output: {output}')
+
+        ds = self.get_dataset(req['data_file'])
+        key = hashlib.sha256(json.dumps([req, ds['fingerprint']], sort_keys=True).encode()).hexdigest()
+        with self.cache_lock: res = self.responses.get(key)
+        if res is not None: return res, { 'cache': True }
+        step('load')
+
+        try:
+            full_df, data_meta, pp_desc = e2e_prepare(req['pp_desc'], None, ds['data'], ds['data_meta'],
+                                                      req.get('check_match', True), req.get('impute', True), fingerprint=ds['fingerprint'])
+            pp_desc = { 'native': True, **pp_desc } # Plot data stays in polars, so data outputs skip pandas
+            pparams = pp_transform_data(full_df, data_meta, pp_desc)
+        except RequestError: raise
+        except Exception as e: raise RequestError(f'Could not process data: {e}')
+        step('transform')
+
+        if output=='spec':
+            kwargs = { k: req[k] for k in plot_options if k in req }
+            if req.get('translate'): # Translation tables are kept per dataset and dictionary, so plot specs can be cached across requests
+                td = req['translate']
+                kwargs['translate'] = get_translation_table(lambda s: td.get(s,s), data_meta, key=(ds['fingerprint'], json.dumps(td, sort_keys=True)))
+            spec = create_plot_spec(pparams, data_meta, pp_desc, **kwargs)
+            if isinstance(spec, PlotMatrix): spec = spec.to_list() # Plots without faceting give a matrix of specs (rows of plots)
+            step('plot')
+            res = ('application/json', json.dumps(spec).encode())
+        else:
+            info = { k: pparams[k] for k in ['value_col', 'filtered_size'] if k in pparams }
+            data = pparams['data']
+            if output=='json':
+                res = ('application/json', json.dumps({ **info, 'data': json.loads(data.write_json()) }).encode())
+            else:
+                table = data.to_arrow()
+                table = table.replace_schema_metadata({ **(table.schema.metadata or {}), b'pparams': json.dumps(info).encode() })
+                sink = pa.BufferOutputStream()
+                with pa.ipc.new_stream(sink, table.schema) as writer: writer.write_table(table)
+                res = ('application/vnd.apache.arrow.stream', sink.getvalue().to_pybytes())
+        step('encode')
+
+        with self.cache_lock:
+            if len(self.responses)>=self.cache_size: del self.responses[next(iter(self.responses))]
+            self.responses[key] = res
+        return res, { 'cache': False, **timings }
+
+    # HTTP server that runs the plot requests on the worker pool
+    def http_server(self, host='127.0.0.1', port=8050):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def send(self, status, content_type, body, headers={}):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in headers.items(): self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_error_json(self, status, message):
+                self.send(status, 'application/json', json.dumps({ 'error': message }).encode())
+
+            def do_GET(self):
+                if self.path.rstrip('/')=='/datasets': self.send(200, 'application/json', json.dumps(sorted(server.files)).encode())
+                else: self.send_error_json(404, f'Unknown path: {self.path}')
+
+            def do_POST(self):
+                if self.path.rstrip('/')!='/plot': return self.send_error_json(404, f'Unknown path: {self.path}')
+                t0 = time.perf_counter()
+                try:
+                    req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or 'null')
+                    (content_type, body), timings = server.pool.submit(server.plot, req).result()
+                except json.JSONDecodeError as e: return self.send_error_json(400, f'Invalid JSON: {e}')
+                except RequestError as e: return self.send_error_json(e.status, str(e))
+                except Exception as e:
+                    traceback.print_exc()
+                    return self.send_error_json(500, repr(e))
+
+                cache = timings.pop('cache')
+                timings['total'] = time.perf_counter()-t0
+                self.send(200, content_type, body, {
+                    'Server-Timing': ', '.join(f'{k};dur={1000*v:.1f}' for k,v in timings.items()),
+                    'X-Cache': 'HIT' if cache else 'MISS' })
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+# Command line entry point
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serve plots of annotated data files over HTTP')
+    parser.add_argument('files', nargs='+', help='Data files, or directories of parquet files')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--workers', type=int, default=4, help='Number of plot requests processed at once')
+    parser.add_argument('--cache-size', type=int, default=256, help='Number of responses kept in cache')
+    parser.add_argument('--preload', action='store_true', help='Load all data files on startup')
+    args = parser.parse_args(args)
+
+    pl.enable_string_cache()
+    files = [ fn for f in args.files for fn in (sorted(glob.glob(os.path.join(f, '*.parquet'))) if os.path.isdir(f) else [f]) ]
+    server = PlotServer(files, workers=args.workers, cache_size=args.cache_size)
+    if args.preload:
+        for name in server.files: server.get_dataset(name)
+
+    httpd = server.http_server(args.host, args.port)
+    print(f'Serving {len(server.files)} data files on http://{args.host}:{httpd.server_address[1]}')
+    try: httpd.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: httpd.server_close(); server.pool.shutdown()
@@ -0,0 +1,101 @@
+"""Generate arbitrarily large synthetic datasets consistent with a data meta, for load testing and performance tuning"""
+
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/07_synthetic.ipynb.
+
+# %% auto 0
+__all__ = ['n_infer_categories', 'synthetic_meta', 'synthetic_columns', 'latent_to_values', 'synthetic_chunks', 'synthetic_data',
+           'save_synthetic_parquet']
+
+# %% ../nbs/07_synthetic.ipynb 3
+import copy
+import itertools as it
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr # Normal cdf
+
+from salk_toolkit.io import read_json, extract_column_meta, save_parquet_with_metadata, add_quantile_sketches
+from salk_toolkit.validation import DataMeta
+
+# %% ../nbs/07_synthetic.ipynb 5
+# Number of categories to use for columns where categories are to be inferred
+n_infer_categories = 5
+
+# Convert a metafile name or DataMeta to a data meta dict in the usual (list-based) format
+def synthetic_meta(data_meta):
+    if isinstance(data_meta, str): data_meta = read_json(data_meta, replace_const=True)
+    elif isinstance(data_meta, DataMeta):
+        data_meta = data_meta.model_dump(mode='json', exclude_none=True, exclude_defaults=True)
+        data_meta['structure'] = [ { **b, 'columns': [ [cn, sn, cm] for cn, (sn, cm) in b['columns'].items() ] }
+                                   for b in data_meta['structure'].values() ]
+    else: data_meta = copy.deepcopy(data_meta)
+    return data_meta
+
+# List columns of the data by block as { block: [(column, column meta)] }
+# Virtual blocks are left out as they are computed when the data is read
+def synthetic_columns(data_meta):
+    c_meta = extract_column_meta(data_meta)
+    res = {}
+    for g in data_meta['structure']:
+        if g.get('virtual'): continue
+        prefix = (g.get('scale') or {}).get('col_prefix','')
+        res[g['name']] = [ (prefix+cn, c_meta[prefix+cn]) for cn in [ (cd if isinstance(cd,str) else cd[0]) for cd in g['columns'] ] ]
+    return res
+
+# Map standard normal latent values to values of a column, preserving their order
+def latent_to_values(z, cm, name):
+    u = ndtr(z)
+    if cm.get('categories'):
+        cats = cm['categories'] if cm['categories']!='infer' else [ f'{name} {i+1}' for i in range(n_infer_categories) ]
+        codes = np.minimum((u*len(cats)).astype(int), len(cats)-1)
+        return pd.Categorical.from_codes(codes, cats, ordered=cm.get('ordered',False))
+    elif cm.get('datetime'): return pd.Timestamp('2020-01-01') + pd.to_timedelta(u*365, unit='D')
+    elif cm.get('val_range'):
+        lo, hi = cm['val_range']
+        return lo + u*(hi-lo)
+    else: return z
+
+# %% ../nbs/07_synthetic.ipynb 6
+# Generate a synthetic dataset of n rows consistent with the data meta, as an iterator of dataframes of at most chunk_size rows
+# Rows get positive weights (mean 1) in weight_col, and if draws is given, a 'draw' column cycling through the draws
+# weight_col defaults to the weight column of the meta (row_weights if it has none), and False leaves the weights out
+def synthetic_chunks(data_meta, n, chunk_size=1000000, draws=0, weight_col=None, block_corr=0.5, global_corr=0.1, seed=0):
+    data_meta = synthetic_meta(data_meta)
+    if weight_col is None: weight_col = data_meta.get('weight_col') or 'row_weights'
+    blocks = synthetic_columns(data_meta)
+    bcorr = { b: (block_corr.get(b,0.0) if isinstance(block_corr,dict) else block_corr) for b in blocks }
+    if any( bc<0 or global_corr<0 or bc+global_corr>1 for bc in bcorr.values() ):
+        raise ValueError('Correlations need to be non-negative with block_corr + global_corr <= 1')
+
+    for ci, start in enumerate(range(0, n, chunk_size)):
+        m = min(chunk_size, n-start)
+        rng = np.random.default_rng([seed, ci])
+        common, df = rng.standard_normal(m), {}
+        for b, cols in blocks.items():
+            shared = rng.standard_normal(m)
+            for cn, cm in cols:
+                z = np.sqrt(global_corr)*common + np.sqrt(bcorr[b])*shared + np.sqrt(1-global_corr-bcorr[b])*rng.standard_normal(m)
+                df[cn] = latent_to_values(z, cm, cn)
+        df = pd.DataFrame(df)
+        if weight_col: df[weight_col] = rng.lognormal(-0.125, 0.5, m) # Mean of lognormal is exp(mu+sigma^2/2) = 1
+        if draws: df['draw'] = (start + np.arange(m)) % draws
+        yield df
+
+# Same as synthetic_chunks, but returns a single dataframe
+def synthetic_data(data_meta, n, **kwargs):
+    return pd.concat(synthetic_chunks(data_meta, n, **kwargs), ignore_index=True)
+
+# Write a synthetic dataset consistent with data_meta (a metafile name, DataMeta or meta dict) into an annotated parquet file
+# draws_data ({ column: [uid, n_draws] }) is added to the meta, so draws for these columns get recomputed in the plot pipeline
+# Quantile sketches of continuous columns come from the first chunk, as the meta is written before the rest are generated
+def save_synthetic_parquet(file_name, data_meta, n, draws_data=None, model_meta=None, **kwargs):
+    data_meta = synthetic_meta(data_meta)
+    if kwargs.get('weight_col'): data_meta['weight_col'] = kwargs['weight_col']
+    if draws_data:
+        missing = set(draws_data) - { cn for cols in synthetic_columns(data_meta).values() for cn,_ in cols }
+        if missing: raise ValueError(f'Columns in draws_data not in data meta: {missing}')
+        data_meta['draws_data'] = draws_data
+        kwargs.setdefault('draws', max( nd for _, nd in draws_data.values() ))
+    chunks = synthetic_chunks(data_meta, n, **kwargs)
+    first = next(chunks, None)
+    if first is not None: add_quantile_sketches(data_meta, first)
+    save_parquet_with_metadata(it.chain([first] if first is not None else [], chunks), { 'data': data_meta, 'model': model_meta or {} }, file_name)
@@ -43,6 +43,7 @@ class ColumnMeta(PBase):
     num_values: Optional[List[Union[float,None]]] = None # For categoricals - how to convert the categories to numbers
     val_format: Optional[str] = None # Format string for the column values - only used with continuous display
     val_range: Optional[Tuple[float,float]] = None # Range of possible values for continuous variables - used for filter bounds etc
+    quantiles: Optional[List[float]] = None # Quantile sketch for continuous variables (see add_quantile_sketches) - used for discretization
     likert: bool = False # For ordered categoricals - if they are likert-type (i.e. symmetric around center)
     topo_feature: Optional[Tuple[str,str,str]] = None # Link to a geojson/topojson [url,type,col_name inside geodata]
     electoral_system: Optional[Dict] = None # Information about electoral system (TODO: spec it out)
@@ -152,6 +153,7 @@ class DataMeta(PBase):
     def check_file(self) -> Self:
         if self.file is None and self.files is None:
             raise ValueError("One of 'file' or 'files' has to be provided")
+        return self
 
 
 # %% ../nbs/06_validation.ipynb 11